@@ -0,0 +1,314 @@
+# benchmark.py
+# -*- coding: utf-8 -*-
+"""
+Mide cada etapa del conteo sobre encuestas sintéticas (con semilla, así dos
+corridas ven exactamente los mismos datos) y guarda los resultados en JSON
+para compararlos contra una corrida anterior.
+
+    python benchmark.py --filas 1000,10000,100000 --salida bench.json
+    python benchmark.py --filas 1000,10000,100000 --comparar bench.json
+
+El tiempo se toma sin tracemalloc (que lo distorsiona) y la memoria en una
+pasada aparte. Con --comparar sale con código 1 si alguna etapa quedó más
+lenta que la tolerancia.
+"""
+
+import io
+import csv
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tracemalloc
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+import reporte_core as core
+
+
+# -----------------------------
+# Generador de encuestas
+# -----------------------------
+# Distritos con las variantes que llegan en los exportes reales: tildes,
+# mayúsculas, espacios de más, sin tilde, respuestas numeradas y vacías.
+DISTRITOS = [
+    "Zapote", "zapote ", "ZAPOTE", "San Francisco", "San Francisco de Dos Ríos",
+    "San José", "sán josé ", "San Jose", "Cañas", "Canas", "Pará", "Para",
+    "La Uruca", "Uruca", "Mata Redonda", "Hatillo", "San Sebastián", "Carmen",
+    "El Carmen", "Merced", "Hospital", "Catedral",
+]
+DISTRITOS_RUIDO = ["", " ", "?", "No sé?", "1. ¿En qué distrito vive?", "2. Otro"]
+RESPUESTAS_SI_NO = ["Sí", "si", "SI", " sí ", "No", "no", "NO.", ""]
+OTRAS_RESPUESTAS = ["Tal vez", "Opción A", "opción b", "Muy de acuerdo", "En desacuerdo", "N/A"]
+
+FORMAS = {
+    "Comunidad": {
+        "header": [
+            "Marca temporal", "1. ¿Acepta participar en la encuesta?", "2. Distrito:",
+            "3. Edad", "4. Sexo",
+        ] + [f"{i}. Pregunta {i}" for i in range(5, 25)],
+        "distrito": 2,
+    },
+    "Comercio": {
+        "header": [
+            "Marca temporal", "¿Autoriza el uso de sus datos?", "Tipo de comercio",
+            "Horario", "¿Ha sido víctima de un delito?",
+        ] + [f"C{i}" for i in range(1, 13)],
+        "distrito": None,
+    },
+    "Policial": {
+        "header": [
+            "Marca temporal", "Consentimiento informado", "Rango", "Años de servicio",
+            "Unidad",
+        ] + [f"P{i}" for i in range(1, 9)],
+        "distrito": None,
+    },
+}
+
+
+def generate_survey(tipo: str, n: int, seed: int = 0) -> bytes:
+    """
+    CSV sintético de n respuestas con la forma del tipo: marca temporal
+    creciente, ráfagas de duplicadas (la misma respuesta reenviada a los
+    pocos minutos), filas cortas o con columnas de más, filas vacías y
+    fechas ilegibles ocasionales.
+    """
+    forma = FORMAS[tipo]
+    header = forma["header"]
+    ncols = len(header)
+    rnd = random.Random(f"{tipo}-{n}-{seed}")
+
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(header)
+
+    t = datetime(2024, 5, 1, 7, 0)
+    prev = None
+    for _ in range(n):
+        if prev is not None and rnd.random() < 0.08:
+            # Ráfaga: se reenvía la anterior entre 1 y 10 minutos después
+            row = list(prev)
+            row[0] = (t + timedelta(minutes=rnd.randint(1, 10))).strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            t += timedelta(seconds=rnd.randint(0, 240))
+            row = [t.strftime("%Y-%m-%d %H:%M:%S"), rnd.choice(RESPUESTAS_SI_NO)]
+            row += [rnd.choice(RESPUESTAS_SI_NO + OTRAS_RESPUESTAS) for _ in range(ncols - 2)]
+            if forma["distrito"] is not None:
+                pool = DISTRITOS_RUIDO if rnd.random() < 0.03 else DISTRITOS
+                row[forma["distrito"]] = rnd.choice(pool)
+            if tipo == "Comunidad":
+                row[3] = str(rnd.randint(18, 85))
+
+        r = rnd.random()
+        if r < 0.02:
+            row = row[:rnd.randint(1, ncols - 1)]
+        elif r < 0.03:
+            row = row + ["extra", "x"]
+        elif r < 0.035:
+            row[0] = "sin fecha"
+
+        w.writerow(row)
+        if rnd.random() < 0.005:
+            w.writerow([])
+            w.writerow(["", " ", ""])
+        prev = row if len(row) == ncols else None
+
+    return out.getvalue().encode("utf-8")
+
+
+# -----------------------------
+# Etapas
+# -----------------------------
+def pipeline_stages(tipo: str, file_bytes: bytes, cat_index: dict, logo_path: str | None):
+    """
+    (nombre, función) en el orden del pipeline. Cada función completa el
+    estado (dict) que reciben las siguientes y devuelve un número para
+    verificar que todas las corridas hicieron lo mismo (filas, eliminadas,
+    bytes del PDF).
+    """
+    def parse(state):
+        state["header"], state["data"] = core.parse_csv_robusto(file_bytes)
+        return len(state["data"])
+
+    def perfil(state):
+        state["profile"], state["yesno"] = core.scan_columns(state["header"], state["data"])
+        state["norm_cols"] = core.norm_columns(state["data"], len(state["header"]))
+        return len(state["profile"])
+
+    def ranking(state):
+        ranked = core.rank_yesno_columns(state["header"], state["data"], top_k=8, profile=state["profile"])
+        state["col"] = core.choose_default_yesno_col(state["header"], state["data"], profile=state["profile"])
+        return len(ranked)
+
+    def fecha(state):
+        state["dt_col"] = core.detect_datetime_col(state["header"], state["data"], profile=state["profile"])
+        return 0 if state["dt_col"] is None else 1
+
+    def duplicadas(state):
+        res = core.dedupe_engine(
+            state["header"], state["data"], minutes=5,
+            norm_cols=state["norm_cols"], profile=state["profile"]
+        )
+        state["table"] = core.take_table(
+            {k: state[k] for k in ("header", "data", "norm_cols", "yesno", "profile")},
+            np.flatnonzero(res["keep"]).tolist()
+        )
+        return res["removed"]
+
+    def base(state):
+        t = state["table"]
+        if tipo == "Comunidad":
+            state["base"] = core.build_base_comunidad(t["header"], t["data"], state["col"], yesno=t["yesno"], profile=t["profile"])
+        else:
+            si, no = core.table_yesno_counts(t, state["col"])
+            state["base"] = core.build_base_from_totals(tipo, "Zapote", si, no)
+        return len(state["base"])
+
+    def catalogo(state):
+        df_cat = core.catalog_lookup(cat_index, "Zapote", tipo)
+        merged = core.merge_base_with_catalog(state["base"], df_cat, tipo)
+        state["report"] = core.apply_meta_calc_auto(merged, count_no_for_total=(tipo == "Policial"))
+        return len(state["report"])
+
+    def pdf(state):
+        empty = pd.DataFrame()
+        dfs = {"Comunidad": empty, "Comercio": empty, "Policial": empty}
+        dfs[tipo] = state["report"]
+        out = core.build_pdf_bytes(
+            delegacion_label="Delegación: Zapote", hora_reporte="08:00", fecha_str="1 de mayo de 2024",
+            logo_path=logo_path, df_com=dfs["Comunidad"], df_con=dfs["Comercio"], df_pol=dfs["Policial"]
+        )
+        return len(out)
+
+    return [
+        ("parse_csv_robusto", parse),
+        ("scan_columns", perfil),
+        ("rank_yesno_columns", ranking),
+        ("detect_datetime_col", fecha),
+        ("dedupe", duplicadas),
+        ("base", base),
+        ("merge_catalogo", catalogo),
+        ("build_pdf_bytes", pdf),
+    ]
+
+
+def run_pipeline(tipo: str, file_bytes: bytes, cat_index: dict, logo_path: str | None, memory: bool) -> list[dict]:
+    # Cachés de normalización vacías: cada corrida mide desde cero
+    core.clear_norm_caches()
+    state = {}
+    out = []
+    for name, fn in pipeline_stages(tipo, file_bytes, cat_index, logo_path):
+        if memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        filas = fn(state)
+        seconds = time.perf_counter() - t0
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        out.append({"etapa": name, "segundos": seconds, "pico_bytes": peak, "resultado": filas})
+    return out
+
+
+def bench(tipos: list[str], sizes: list[int], repeat: int, memory: bool, seed: int, catalog_path: str, logo_path: str | None) -> dict:
+    cat_index = core.load_catalog_index(catalog_path, cache_dir=None)
+    results = []
+    for tipo in tipos:
+        for n in sizes:
+            t0 = time.perf_counter()
+            file_bytes = generate_survey(tipo, n, seed)
+            gen_s = time.perf_counter() - t0
+
+            # Mejor de `repeat` corridas para el tiempo
+            best = None
+            for _ in range(repeat):
+                run = run_pipeline(tipo, file_bytes, cat_index, logo_path, memory=False)
+                if best is None:
+                    best = run
+                else:
+                    for b, r in zip(best, run):
+                        b["segundos"] = min(b["segundos"], r["segundos"])
+            if memory:
+                for b, r in zip(best, run_pipeline(tipo, file_bytes, cat_index, logo_path, memory=True)):
+                    b["pico_bytes"] = r["pico_bytes"]
+
+            for b in best:
+                results.append({"tipo": tipo, "filas": n, "csv_bytes": len(file_bytes), **b})
+            total = sum(b["segundos"] for b in best)
+            print(f"{tipo:<10} {n:>9,} filas  {total:8.3f} s  (generar {gen_s:.1f} s)", file=sys.stderr)
+
+    return {
+        "meta": {
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "plataforma": platform.platform(),
+            "semilla": seed,
+            "repeticiones": repeat,
+        },
+        "resultados": results,
+    }
+
+
+def compare(current: dict, baseline: dict, tolerance: float) -> pd.DataFrame:
+    key = ["tipo", "filas", "etapa"]
+    cur = pd.DataFrame(current["resultados"]).set_index(key)
+    base = pd.DataFrame(baseline["resultados"]).set_index(key)
+    df = cur[["segundos", "pico_bytes"]].join(base[["segundos", "pico_bytes"]], rsuffix="_base", how="inner")
+    df["ratio"] = df["segundos"] / df["segundos_base"].where(df["segundos_base"] > 0)
+    # Etapas de menos de 5 ms son ruido: no cuentan como regresión
+    df["regresion"] = (df["ratio"] > 1 + tolerance) & (df["segundos"] > 0.005)
+    return df.reset_index()
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark del pipeline de conteo.")
+    ap.add_argument("--filas", default="1000,10000,100000", help="tamaños separados por coma (default: %(default)s)")
+    ap.add_argument("--tipos", default="Comunidad,Comercio,Policial")
+    ap.add_argument("--repeticiones", type=int, default=3)
+    ap.add_argument("--semilla", type=int, default=0)
+    ap.add_argument("--sin-memoria", action="store_true", help="no medir el pico de memoria (tracemalloc)")
+    ap.add_argument("--catalogo", default="catalogo_metas.xlsx")
+    ap.add_argument("--logo", default="001.png")
+    ap.add_argument("--salida", help="JSON donde guardar los resultados")
+    ap.add_argument("--comparar", help="JSON de una corrida anterior")
+    ap.add_argument("--tolerancia", type=float, default=0.2, help="regresión si tarda más de (1 + t) veces (default: %(default)s)")
+    return ap.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    sizes = [int(x.replace("_", "")) for x in args.filas.split(",") if x.strip()]
+    tipos = [t.strip() for t in args.tipos.split(",") if t.strip()]
+    logo_path = args.logo if args.logo and Path(args.logo).exists() else None
+
+    result = bench(tipos, sizes, max(args.repeticiones, 1), not args.sin_memoria, args.semilla, args.catalogo, logo_path)
+
+    df = pd.DataFrame(result["resultados"])
+    df["pico_mb"] = (pd.to_numeric(df["pico_bytes"]) / 1e6).round(1)
+    print(df[["tipo", "filas", "etapa", "segundos", "pico_mb", "resultado"]].round({"segundos": 4}).to_string(index=False))
+
+    if args.salida:
+        Path(args.salida).write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    if args.comparar:
+        baseline = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+        cmp = compare(result, baseline, args.tolerancia)
+        print()
+        print(cmp[["tipo", "filas", "etapa", "segundos_base", "segundos", "ratio", "regresion"]].round(3).to_string(index=False))
+        if cmp["regresion"].any():
+            print(f"\n{int(cmp['regresion'].sum())} etapas más lentas que la base", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# reporte_cli.py
+# -*- coding: utf-8 -*-
+"""
+Genera los reportes de todas las delegaciones sin abrir Streamlit.
+
+    python reporte_cli.py carpeta_csv/ --salida reportes/
+    python reporte_cli.py carpeta_csv/ --zip reportes.zip --duplicadas comunidad,policial
+
+Los CSV se clasifican por nombre igual que en la app (Comunidad_<Lugar>.csv,
+Comercio_..., Policial_...). Sale con código 1 si alguna delegación falló.
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+from reporte_core import (
+    DEDUPE_ANCHORED,
+    DEDUPE_SLIDING,
+    PDF_WORKERS,
+    CACHE_DIR,
+    REPORT_TIPOS,
+    STORE_FILE,
+    ParseCache,
+    ResultStore,
+    STAGE_METRICS,
+    configure_stage_log,
+    fecha_es,
+    iter_batch_reports,
+    load_catalog_index,
+    write_reports_dir,
+    write_reports_zip,
+)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Reportes por delegación (Comunidad / Comercio / Policial).")
+    ap.add_argument("carpeta", help="carpeta con los CSV exportados")
+    ap.add_argument("--catalogo", default="catalogo_metas.xlsx", help="xlsx con las metas (default: %(default)s)")
+    ap.add_argument("--salida", default="reportes", help="carpeta donde dejar los PDF (default: %(default)s)")
+    ap.add_argument("--zip", dest="zip_path", help="en vez de una carpeta, escribir un ZIP")
+    ap.add_argument("--logo", default="001.png", help="logo del encabezado (default: %(default)s)")
+    ap.add_argument("--hora", default="", help="hora del reporte que sale en el PDF")
+    ap.add_argument("--duplicadas", default="", help="tipos a los que se les eliminan duplicadas, separados por coma")
+    ap.add_argument("--minutos", type=int, default=5, help="ventana de duplicadas en minutos (default: %(default)s)")
+    ap.add_argument("--ventana", choices=[DEDUPE_ANCHORED, DEDUPE_SLIDING], default=DEDUPE_ANCHORED)
+    ap.add_argument("--procesos", type=int, default=PDF_WORKERS, help="procesos para generar los PDF (default: %(default)s)")
+    ap.add_argument("--cache-dir", default=CACHE_DIR, help="carpeta del caché compartido con la app (default: %(default)s)")
+    ap.add_argument("--sin-cache", action="store_true", help="no leer ni guardar en el caché en disco")
+    ap.add_argument("--log-etapas", metavar="ARCHIVO", help="escribir una línea JSON por etapa medida ('-' = stderr)")
+    ap.add_argument("--medir-memoria", action="store_true", help="incluir el pico de memoria en las métricas (más lento)")
+    ap.add_argument("--solo-csv", action="store_true", help="no generar las delegaciones del catálogo que no tienen CSV")
+    return ap.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_stage_log(args.log_etapas)
+    STAGE_METRICS.set_memory(args.medir_memoria)
+
+    if not Path(args.carpeta).is_dir():
+        print(f"No existe la carpeta {args.carpeta}", file=sys.stderr)
+        return 2
+    paths = sorted(p for p in Path(args.carpeta).iterdir() if p.suffix.lower() == ".csv")
+    if not paths:
+        print(f"No hay CSV en {args.carpeta}", file=sys.stderr)
+        return 2
+
+    cat_index = load_catalog_index(args.catalogo, cache_dir=None if args.sin_cache else args.cache_dir)
+    if cat_index["df"].empty:
+        print(f"Aviso: no encontré el catálogo '{args.catalogo}', las metas salen en 0.", file=sys.stderr)
+
+    tipos = {t.strip().lower() for t in args.duplicadas.split(",") if t.strip()}
+    dedupe = {t: t.lower() in tipos for t in REPORT_TIPOS}
+
+    logo_path = args.logo if args.logo and Path(args.logo).exists() else None
+    store = None if args.sin_cache else ResultStore(Path(args.cache_dir) / STORE_FILE)
+
+    t0 = time.perf_counter()
+    # Con carpeta de salida cada proceso escribe su PDF; con ZIP vuelven los bytes
+    out_dir = None if args.zip_path else Path(args.salida)
+    if out_dir is not None:
+        out_dir.mkdir(parents=True, exist_ok=True)
+    reports = iter_batch_reports(
+        [p.name for p in paths],
+        lambda i: paths[i].read_bytes(),
+        cat_index,
+        cache=ParseCache(store=store),
+        hora_reporte=args.hora,
+        fecha_str=fecha_es(datetime.now()),
+        logo_path=logo_path,
+        dedupe=dedupe,
+        dedupe_minutes=args.minutos,
+        dedupe_mode=args.ventana,
+        include_catalog=not args.solo_csv,
+        pdf_workers=args.procesos,
+        out_dir=out_dir
+    )
+    if args.zip_path:
+        with open(args.zip_path, "wb") as fh:
+            resumen = write_reports_zip(reports, fh)
+        destino = args.zip_path
+    else:
+        resumen = write_reports_dir(reports, out_dir)
+        destino = out_dir
+
+    errores = resumen[resumen["error"] != ""]
+    print(resumen.to_string(index=False))
+    print(f"\n{len(resumen) - len(errores)} PDF en {destino} ({time.perf_counter() - t0:.1f} s)")
+    for _, r in errores.iterrows():
+        print(f"ERROR {r['Delegación']}: {r['error']}", file=sys.stderr)
+    return 1 if len(errores) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
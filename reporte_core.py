@@ -0,0 +1,3341 @@
+# reporte_core.py
+# -*- coding: utf-8 -*-
+"""
+Núcleo del reporte sin Streamlit: lectura de CSV, normalización, SI/NO,
+duplicadas, catálogo, metas y PDF. Lo usan app.py (la UI) y reporte_cli.py
+(lotes desde la terminal o cron).
+"""
+
+import io
+import os
+import sys
+import re
+import csv
+import codecs
+import json
+import time
+import zlib
+import pickle
+import logging
+import sqlite3
+import hashlib
+import zipfile
+import warnings
+import threading
+import tracemalloc
+import unicodedata
+import multiprocessing
+from collections import OrderedDict, deque
+from contextlib import closing, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache, wraps
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from PIL import Image as PILImage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Opcional (ver requirements.txt): sin él las tablas se guardan con pickle
+    pa = pq = None
+
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+from reportlab.platypus import (
+    SimpleDocTemplate,
+    Paragraph,
+    Spacer,
+    Table,
+    TableStyle,
+    Image as RLImage,
+    KeepTogether
+)
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+
+
+# -----------------------------
+# Normalización fuerte
+# -----------------------------
+# Los exports repiten unos pocos cientos de textos distintos en miles de
+# celdas: las normalizaciones se memorizan por valor (LRU acotado), así el
+# costo escala con los valores distintos y no con las celdas.
+NORM_CACHE_SIZE = 65536
+
+RE_SPACES = re.compile(r"\s+")
+RE_PLACE_SPLIT = re.compile(r"\s*[,;/\-]\s*")
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def strip_accents(s: str) -> str:
+    s = unicodedata.normalize("NFD", s)
+    return "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _visible_text(s: str) -> str:
+    s = s.strip().strip("\ufeff")
+    s = s.replace("\n", " ").replace("\r", " ")
+    s = unicodedata.normalize("NFC", s)
+    s = RE_SPACES.sub(" ", s).strip()
+    return s
+
+
+def normalize_visible_text(v) -> str:
+    """
+    Normaliza texto visible sin perder ñ, tildes ni caracteres especiales.
+    """
+    if v is None:
+        return ""
+    return _visible_text(v if type(v) is str else str(v))
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _norm(s: str) -> str:
+    s = _visible_text(s)
+    s = strip_accents(s).lower().strip()
+    s = RE_SPACES.sub(" ", s).strip()
+    s = s.replace("sí", "si").replace("si.", "si").replace("no.", "no")
+    return s
+
+
+def norm(v) -> str:
+    if v is None:
+        return ""
+    return _norm(v if type(v) is str else str(v))
+
+
+def is_yes(v) -> bool:
+    return norm(v) == "si"
+
+
+def is_no(v) -> bool:
+    return norm(v) == "no"
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _pretty_title(s: str) -> str:
+    t = _visible_text(s)
+    t = t.replace("_", " ").replace("-", " ")
+    t = RE_SPACES.sub(" ", t).strip()
+    return t.title()
+
+
+def pretty_title(s: str) -> str:
+    if s is None:
+        return ""
+    return _pretty_title(s if type(s) is str else str(s))
+
+
+# -----------------------------
+# Normalización ROBUSTA de lugar/distrito
+# -----------------------------
+PLACE_ALIASES = {
+    "la uruca": "uruca",
+    "uruca": "uruca",
+    "zapote": "zapote",
+    "san jose de la montana": "san jose de la montana",
+    "para": "para",
+    "la ribera": "la ribera",
+    "ribera": "la ribera",
+    "canas": "canas",
+    "anaselmo llorente": "anselmo llorente",
+    "anselmo llorente": "anselmo llorente",
+    "pacuare": "pacuare",
+    "pacuarito": "pacuare",
+    "Vara Blanca": " Vara Blanca",
+    "varablanca": "Vara Blanca",
+}
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def _place_key(s: str) -> str:
+    s = _visible_text(s)
+    s = strip_accents(s).casefold().strip()
+    s = RE_PLACE_SPLIT.split(s)[0].strip()
+    s = RE_SPACES.sub(" ", s).strip(" .,:;-/")
+    return PLACE_ALIASES.get(s, s)
+
+
+def normalize_place_key(v) -> str:
+    """
+    Clave robusta para comparar distritos/delegaciones sin romper el texto visible.
+    """
+    if v is None:
+        return ""
+    return _place_key(v if type(v) is str else str(v))
+
+
+NORM_CACHES = {
+    "strip_accents": strip_accents,
+    "normalize_visible_text": _visible_text,
+    "norm": _norm,
+    "pretty_title": _pretty_title,
+    "normalize_place_key": _place_key,
+}
+
+
+def norm_cache_stats() -> pd.DataFrame:
+    """
+    Aciertos/fallos y tamaño de cada caché de normalización.
+    """
+    rows = []
+    for name, fn in NORM_CACHES.items():
+        info = fn.cache_info()
+        total = info.hits + info.misses
+        rows.append({
+            "funcion": name,
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+            "hit_ratio": (info.hits / total) if total > 0 else 0.0,
+        })
+    return pd.DataFrame(rows)
+
+
+def clear_norm_caches():
+    for fn in NORM_CACHES.values():
+        fn.cache_clear()
+
+
+# -----------------------------
+# Métricas por etapa
+# -----------------------------
+# Las etapas pesadas van envueltas con @instrumented: tiempo, filas y, si se
+# pide, pico de memoria (tracemalloc). Quedan en STAGE_METRICS para el panel
+# de diagnóstico y salen como una línea JSON por el logger "reporte.etapas".
+STAGE_LOG = logging.getLogger("reporte.etapas")
+STAGE_METRICS_MAX_RECORDS = 500
+STAGE_METRICS_COLUMNS = ["seq", "etapa", "filas", "segundos", "pico_mb", "error"]
+
+
+class StageMetrics:
+    """
+    Registro acotado de las últimas mediciones (compartido entre reruns y
+    sesiones). La medición de memoria se prende por hilo (en Streamlit, por
+    sesión); si dos sesiones la usan a la vez el pico es aproximado, porque
+    tracemalloc es uno solo por proceso.
+    """
+
+    def __init__(self, max_records: int = STAGE_METRICS_MAX_RECORDS):
+        self._started_tracing = False
+        self._memory_threads = set()
+        self._records = deque(maxlen=max_records)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def memory(self) -> bool:
+        """¿Este hilo mide memoria?"""
+        return getattr(self._local, "memory", False)
+
+    def set_memory(self, on: bool):
+        """
+        Prende/apaga la medición de memoria de este hilo (hace todo 2-3 veces
+        más lento). tracemalloc queda prendido mientras algún hilo vivo la
+        pida y solo se apaga si lo prendimos nosotros.
+        """
+        self._local.memory = bool(on)
+        with self._lock:
+            if on:
+                self._memory_threads.add(threading.get_ident())
+            else:
+                self._memory_threads.discard(threading.get_ident())
+            self._memory_threads &= {t.ident for t in threading.enumerate()}
+            if self._memory_threads and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            elif not self._memory_threads and self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def _stack(self) -> list:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def measure(self, stage: str):
+        """
+        Mide el bloque y guarda un registro; se puede completar "filas" en el
+        dict que devuelve. Las etapas anidadas también suman al pico de la
+        etapa de afuera.
+        """
+        rec = {"etapa": stage, "filas": None, "segundos": 0.0, "pico_mb": None, "error": ""}
+        memory = self.memory and tracemalloc.is_tracing()
+        stack = self._stack()
+        frame = None
+        if memory:
+            cur, peak = tracemalloc.get_traced_memory()
+            for f in stack:
+                f["peak"] = max(f["peak"], peak)
+            tracemalloc.reset_peak()
+            frame = {"start": cur, "peak": cur}
+            stack.append(frame)
+
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        except Exception as e:
+            rec["error"] = type(e).__name__
+            raise
+        finally:
+            rec["segundos"] = time.perf_counter() - t0
+            if frame is not None:
+                stack.pop()
+                if tracemalloc.is_tracing():
+                    peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                    rec["pico_mb"] = (peak - frame["start"]) / 1e6
+            self.add(rec)
+
+    def add(self, rec: dict):
+        with self._lock:
+            self._seq += 1
+            rec = dict(rec, seq=self._seq)
+            self._records.append(rec)
+        if STAGE_LOG.isEnabledFor(logging.INFO):
+            STAGE_LOG.info(json.dumps(rec, ensure_ascii=False))
+
+    def extend(self, records: Iterable[dict]):
+        """
+        Suma registros medidos en otro proceso (p. ej. el pool de PDF).
+        """
+        for rec in records:
+            self.add({k: v for k, v in rec.items() if k != "seq"})
+
+    def mark(self) -> int:
+        """
+        Número del último registro: records(mark) da solo lo medido después.
+        """
+        return self._seq
+
+    def raw(self, since: int = 0) -> list[dict]:
+        with self._lock:
+            return [r for r in self._records if r["seq"] > since]
+
+    def records(self, since: int = 0) -> pd.DataFrame:
+        return pd.DataFrame(self.raw(since), columns=STAGE_METRICS_COLUMNS)
+
+    def stats(self, since: int = 0) -> pd.DataFrame:
+        """
+        Resumen por etapa: llamadas, filas, tiempo total/máximo y pico.
+        """
+        df = self.records(since)
+        out = df.groupby("etapa", sort=False).agg(
+            llamadas=("seq", "size"),
+            filas=("filas", "sum"),
+            total_s=("segundos", "sum"),
+            max_s=("segundos", "max"),
+            pico_mb=("pico_mb", "max"),
+        ).reset_index()
+        return out.sort_values("total_s", ascending=False).reset_index(drop=True)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+STAGE_METRICS = StageMetrics()
+_STAGE_LOG_TARGET = None
+_STAGE_LOG_LOCK = threading.Lock()
+
+
+def configure_stage_log(target: str | None):
+    """
+    Manda STAGE_LOG a target ('-' = stderr, si no un archivo). Se puede
+    llamar en cada rerun: solo agrega el handler la primera vez.
+    """
+    global _STAGE_LOG_TARGET
+    if not target:
+        return
+    with _STAGE_LOG_LOCK:
+        if _STAGE_LOG_TARGET is not None:
+            return
+        if target == "-":
+            handler = logging.StreamHandler(sys.stderr)
+        else:
+            handler = logging.FileHandler(target, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        STAGE_LOG.addHandler(handler)
+        STAGE_LOG.setLevel(logging.INFO)
+        STAGE_LOG.propagate = False
+        _STAGE_LOG_TARGET = target
+
+
+def instrumented(stage: str, rows: Callable | None = None):
+    """
+    Decorador: mide cada llamada en STAGE_METRICS. rows(resultado, *args,
+    **kwargs) da la cantidad de filas procesadas.
+    """
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with STAGE_METRICS.measure(stage) as rec:
+                out = fn(*args, **kwargs)
+                if rows is not None:
+                    rec["filas"] = rows(out, *args, **kwargs)
+            return out
+        return wrapper
+    return deco
+
+
+def _data_rows(out, header=None, data=None, *args, **kwargs):
+    return len(data) if data else None
+
+
+def _parsed_rows(out, *args, **kwargs):
+    return len(out[1])
+
+
+def _result_rows(out, *args, **kwargs):
+    return len(out) if out is not None else None
+
+
+def _pdf_rows(out, delegacion_label, hora_reporte, fecha_str, logo_path, df_com, df_con, df_pol):
+    return sum(len(df) for df in (df_com, df_con, df_pol) if df is not None)
+
+
+# -----------------------------
+# Fecha en español
+# -----------------------------
+SPANISH_WEEKDAYS = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
+SPANISH_MONTHS = ["enero", "febrero", "marzo", "abril", "mayo", "junio",
+                  "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"]
+
+
+def fecha_es(dt: datetime) -> str:
+    wd = SPANISH_WEEKDAYS[dt.weekday()]
+    month = SPANISH_MONTHS[dt.month - 1]
+    return f"{wd}, {dt.day} de {month} de {dt.year}"
+
+
+# -----------------------------
+# Inferir tipo/lugar por filename
+# -----------------------------
+def infer_tipo_lugar(filename: str):
+    base = normalize_visible_text(Path(filename).stem)
+    m = re.match(r"(?i)^(policial|comunidad|comercio)_(.+?)_(\d{4}).*", base)
+    if m:
+        tipo = m.group(1).capitalize()
+        lugar = normalize_visible_text(m.group(2).replace("_", " ").strip())
+        return tipo, lugar
+
+    parts = base.split("_")
+    if len(parts) >= 2:
+        tipo = normalize_visible_text(parts[0]).capitalize()
+        lugar = normalize_visible_text(parts[1].replace("_", " ").strip())
+        return tipo, lugar
+
+    return "Desconocida", normalize_visible_text(base)
+
+
+def build_upload_index(names: list[str]) -> dict:
+    """
+    Clasifica los nombres de archivo una sola vez y arma búsquedas directas:
+    - "archivos": [(nombre, tipo, lugar)] en el orden de subida
+    - "lugares": lugares distintos, tal como vienen en los nombres
+    - "por_lugar": {clave de lugar: [posiciones]}
+    - "por_tipo": {(clave de lugar, tipo en minúsculas): [posiciones]}
+    """
+    archivos = []
+    lugares = []
+    por_lugar = {}
+    por_tipo = {}
+    for i, name in enumerate(names):
+        tipo, lugar = infer_tipo_lugar(name)
+        key = normalize_place_key(lugar)
+        archivos.append((name, tipo, lugar))
+        if lugar not in lugares:
+            lugares.append(lugar)
+        por_lugar.setdefault(key, []).append(i)
+        por_tipo.setdefault((key, tipo.lower()), []).append(i)
+    return {
+        "archivos": archivos,
+        "lugares": lugares,
+        "por_lugar": por_lugar,
+        "por_tipo": por_tipo,
+    }
+
+
+# -----------------------------
+# Tabla por columnas
+# -----------------------------
+# Las filas se guardan por columna (un arreglo object por columna) y no
+# como una lista por fila. Un subconjunto de filas (duplicadas, cola de un
+# archivo extendido) es una vista: comparte los arreglos y lleva un índice.
+# Al serializar (store, pickle) se escribe en Parquet si está pyarrow.
+#
+# Las columnas con pocos valores distintos (distrito, SI/NO, opciones) se
+# codifican al leerlas: un código entero por fila más el diccionario de
+# valores (ver Coded). norm() y compañía corren sobre el diccionario y las
+# columnas normalizadas comparten los códigos de las originales. Fechas y
+# texto libre quedan como arreglo object.
+DICT_MAX_RATIO = 0.5
+
+
+def small_codes(codes: np.ndarray, n: int) -> np.ndarray:
+    """
+    Códigos en el entero más chico que alcanza para n valores.
+    """
+    dtype = np.int8 if n <= 127 else np.int16 if n <= 32767 else np.int32
+    return codes.astype(dtype, copy=False)
+
+
+class Coded:
+    """
+    Columna codificada: dictionary[codes] son los valores. Se indexa como un
+    arreglo (col[i], col[a:b]) y np.asarray(col) da los valores. El
+    diccionario puede tener valores que ninguna fila usa (p. ej. en una
+    vista después de deduplicar): ver used().
+    """
+
+    __slots__ = ("codes", "dictionary")
+
+    def __init__(self, codes: np.ndarray, dictionary: np.ndarray):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.dictionary[self.codes[i]]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.dictionary[self.codes]
+        return values if dtype is None else values.astype(dtype, copy=False)
+
+    def take(self, index) -> "Coded":
+        return Coded(self.codes[index], self.dictionary)
+
+    def used(self) -> np.ndarray:
+        """
+        Valores del diccionario que aparecen en alguna fila.
+        """
+        return self.dictionary[np.bincount(self.codes, minlength=len(self.dictionary)) > 0]
+
+    def map(self, fn) -> "Coded":
+        """
+        fn aplicada una vez por valor del diccionario; los códigos no cambian.
+        """
+        return Coded(self.codes, np.array([fn(u) for u in self.dictionary], dtype=object))
+
+    @classmethod
+    def concat(cls, parts: list["Coded"]) -> "Coded":
+        # El diccionario del primero queda igual; los demás agregan sus valores nuevos
+        remap, dictionary = pd.factorize(np.concatenate([p.dictionary for p in parts]), use_na_sentinel=False)
+        codes, start = [], 0
+        for p in parts:
+            codes.append(remap[start:start + len(p.dictionary)][p.codes])
+            start += len(p.dictionary)
+        return cls(small_codes(np.concatenate(codes), len(dictionary)), np.asarray(dictionary, dtype=object))
+
+
+def factorize_values(values) -> Coded:
+    """
+    Códigos y valores distintos (en orden de aparición) de una columna. Una
+    columna que ya viene codificada se devuelve tal cual.
+    """
+    if isinstance(values, Coded):
+        return values
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+    return Coded(small_codes(codes, len(uniques)), np.asarray(uniques, dtype=object))
+
+
+def encode_column(values):
+    """
+    Coded si la columna repite valores (a lo sumo DICT_MAX_RATIO distintos
+    por fila); si no, el arreglo object.
+    """
+    if isinstance(values, Coded):
+        return values
+    values = np.asarray(values, dtype=object)
+    coded = factorize_values(values)
+    if len(coded.dictionary) <= DICT_MAX_RATIO * len(values):
+        return coded
+    return values
+
+
+class Columns:
+    """
+    Como un DataFrame chico: len() es la cantidad de filas y cols[j] (o
+    iterar) da los valores de las columnas; column(j) la da como está
+    guardada (Coded o arreglo). row(i) arma una fila; rows() todas.
+    """
+
+    def __init__(self, columns: list, index=None):
+        self._cols = [c if isinstance(c, Coded) else np.asarray(c, dtype=object) for c in columns]
+        self._index = index
+        if index is None:
+            self._n = len(self._cols[0]) if self._cols else 0
+        elif isinstance(index, slice):
+            self._n = len(range(*index.indices(len(self._cols[0]) if self._cols else 0)))
+        else:
+            self._n = len(index)
+
+    @classmethod
+    def from_rows(cls, rows: list[list[str]], ncols: int) -> "Columns":
+        """
+        Filas ya alineadas (todas de largo ncols).
+        """
+        if not rows:
+            return cls([np.empty(0, dtype=object) for _ in range(ncols)])
+        return cls([encode_column(np.array(c, dtype=object)) for c in zip(*rows)])
+
+    @classmethod
+    def concat(cls, parts: list["Columns"]) -> "Columns":
+        parts = [p for p in parts if p.ncols]
+        if not parts:
+            return cls([])
+        cols = []
+        for j in range(parts[0].ncols):
+            col = [p.column(j) for p in parts]
+            if any(isinstance(c, Coded) for c in col):
+                cols.append(Coded.concat([factorize_values(c) for c in col]))
+            else:
+                cols.append(np.concatenate(col))
+        return cls(cols)
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def ncols(self) -> int:
+        return len(self._cols)
+
+    def column(self, j: int):
+        col = self._cols[j]
+        if self._index is None:
+            return col
+        return col.take(self._index) if isinstance(col, Coded) else col[self._index]
+
+    def __getitem__(self, j: int) -> np.ndarray:
+        col = self.column(j)
+        return np.asarray(col) if isinstance(col, Coded) else col
+
+    def __iter__(self):
+        return (self[j] for j in range(self.ncols))
+
+    def row(self, i: int) -> list[str]:
+        if self._index is not None:
+            i = range(len(self._cols[0]))[self._index][i] if isinstance(self._index, slice) else self._index[i]
+        return [c[i] for c in self._cols]
+
+    def rows(self) -> list[list[str]]:
+        if not self._n:
+            return []
+        return [list(r) for r in zip(*self)]
+
+    def take(self, indices) -> "Columns":
+        """
+        Vista con las filas indices (posiciones dentro de esta vista).
+        """
+        if isinstance(indices, slice) and self._index is None:
+            return Columns(self._cols, indices)
+        if self._index is None:
+            base = np.arange(self._n)
+        elif isinstance(self._index, slice):
+            base = np.arange(len(self._cols[0]))[self._index]
+        else:
+            base = self._index
+        return Columns(self._cols, base[indices])
+
+    def head(self, n: int) -> "Columns":
+        return self.take(slice(0, min(n, self._n)))
+
+    def tail(self, start: int) -> "Columns":
+        return self.take(slice(start, self._n))
+
+    def compact(self) -> "Columns":
+        """
+        Copia sin índice (solo las filas de la vista).
+        """
+        return self if self._index is None else Columns([self.column(j) for j in range(self.ncols)])
+
+    def __reduce__(self):
+        if pq is not None and self.ncols:
+            return columns_from_parquet, (columns_to_parquet(self),)
+        return Columns, ([self.column(j) for j in range(self.ncols)],)
+
+
+def _arrow_column(col):
+    if isinstance(col, Coded):
+        # Las columnas normalizadas repiten valores en el diccionario ("Sí" y
+        # "si" -> "si"): se juntan, si no los códigos comprimen peor
+        remap, dictionary = pd.factorize(col.dictionary, use_na_sentinel=False)
+        codes = remap[col.codes] if len(dictionary) < len(col.dictionary) else col.codes
+        return pa.DictionaryArray.from_arrays(codes, pa.array(dictionary, type=pa.string()))
+    return pa.array(col, type=pa.string())
+
+
+def columns_to_parquet(cols: Columns) -> bytes:
+    table = pa.table({str(j): _arrow_column(cols.column(j)) for j in range(cols.ncols)})
+    buff = pa.BufferOutputStream()
+    pq.write_table(table, buff, compression="zstd")
+    return buff.getvalue().to_pybytes()
+
+
+def _column_from_arrow(chunked):
+    if not pa.types.is_dictionary(chunked.type):
+        return chunked.to_numpy(zero_copy_only=False)
+    # Parquet arma un diccionario por grupo de filas: se unifican antes de juntar
+    arr = chunked.unify_dictionaries().combine_chunks()
+    dictionary = arr.dictionary.to_numpy(zero_copy_only=False)
+    return Coded(small_codes(arr.indices.to_numpy(), len(dictionary)), dictionary)
+
+
+def columns_from_parquet(blob: bytes) -> Columns:
+    table = pq.read_table(pa.BufferReader(blob))
+    return Columns([_column_from_arrow(c) for c in table.columns])
+
+
+def column_values(data, j: int):
+    """
+    Valores de la columna j: de Columns (sin copiar filas) o de una lista
+    de filas (como la devolvían las versiones anteriores).
+    """
+    if isinstance(data, Columns):
+        return data[j]
+    return [r[j] if j < len(r) else "" for r in data]
+
+
+def column_data(data, j: int):
+    """
+    Como column_values, pero una columna codificada queda como Coded (para
+    trabajar sobre el diccionario y los códigos sin armar los valores).
+    """
+    if isinstance(data, Columns):
+        return data.column(j)
+    return column_values(data, j)
+
+
+def head_rows(data, n: int):
+    return data.head(n) if isinstance(data, Columns) else data[:n]
+
+
+def rows_at(data, indices) -> dict:
+    """
+    {índice: fila} para unas pocas filas (para mostrar).
+    """
+    if isinstance(data, Columns):
+        return {int(i): data.row(int(i)) for i in indices}
+    return {int(i): data[int(i)] for i in indices}
+
+
+# -----------------------------
+# CSV robusto + ALINEACIÓN filas
+# -----------------------------
+# Los exportes vienen en UTF-8 (con o sin BOM), pero los que pasan por Excel
+# suelen salir en Windows-1252 y/o separados por ";". Se decide mirando solo
+# unos KB: el comienzo del archivo y el primer tramo con bytes no ASCII.
+CSV_SNIFF_BYTES = 16 * 1024
+CSV_SCAN_BLOCK_BYTES = 1024 * 1024
+CSV_DELIMITERS = [",", ";", "\t", "|"]
+CSV_SNIFF_CONSISTENCY = 0.9
+# Columnas de más que lee el parser en C para no perder las filas con texto
+# solo después del header (sin usecols: no puede pedir más que la más ancha)
+CSV_EXTRA_COLS = 8
+CSV_FALLBACK_ENCODING = "cp1252"
+# Fracción de bytes no ASCII inválidos en UTF-8 desde la que se usa cp1252
+CSV_FALLBACK_MIN_SHARE = 0.5
+DEFAULT_DIALECT = {"encoding": "utf-8-sig", "delimiter": ",", "quotechar": '"', "ncols": None}
+RE_NON_ASCII = re.compile(rb"[\x80-\xff]")
+RE_SURROGATE_ESCAPE = re.compile("[\udc80-\udcff]")
+
+
+def _invalid_utf8_share(chunk: bytes) -> float:
+    """
+    Fracción de los bytes no ASCII de chunk que no forman UTF-8 válido. Un
+    carácter cortado al final del tramo no cuenta como error.
+    """
+    text = codecs.getincrementaldecoder("utf-8")("surrogateescape").decode(chunk, final=False)
+    bad = len(RE_SURROGATE_ESCAPE.findall(text))
+    non_ascii = len(RE_NON_ASCII.findall(chunk))
+    return bad / non_ascii if non_ascii else 0.0
+
+
+def sniff_encoding(file_bytes: bytes) -> str:
+    """
+    UTF-8 salvo que buena parte de los bytes no ASCII del primer tramo no lo
+    sean: un byte suelto en un exporte UTF-8 sale como U+FFFD en su celda
+    (errors="replace") en vez de pasar todo el archivo a Windows-1252.
+    """
+    if file_bytes.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if file_bytes.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    m = RE_NON_ASCII.search(file_bytes)
+    if m is None:
+        return "utf-8-sig"
+    return _encoding_from(file_bytes[m.start():m.start() + CSV_SNIFF_BYTES])
+
+
+def _encoding_from(chunk: bytes) -> str:
+    # chunk empieza en el primer byte no ASCII del archivo
+    if _invalid_utf8_share(chunk) < CSV_FALLBACK_MIN_SHARE:
+        return "utf-8-sig"
+    return CSV_FALLBACK_ENCODING
+
+
+def sniff_stream_encoding(raw) -> str:
+    """
+    sniff_encoding sobre un archivo binario, leyéndolo de a bloques hasta el
+    primer byte no ASCII (que puede estar a muchos MB del comienzo). Deja
+    raw al comienzo.
+    """
+    try:
+        head = raw.read(CSV_SNIFF_BYTES)
+        if head.startswith((codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return sniff_encoding(head)
+        block = head
+        while block:
+            m = RE_NON_ASCII.search(block)
+            if m is not None:
+                chunk = block[m.start():]
+                return _encoding_from(chunk + raw.read(max(CSV_SNIFF_BYTES - len(chunk), 0)))
+            block = raw.read(CSV_SCAN_BLOCK_BYTES)
+        return "utf-8-sig"
+    finally:
+        raw.seek(0)
+
+
+def _complete_lines(sample: str, truncated: bool) -> str:
+    # Sin la última línea si la muestra la corta a la mitad
+    if truncated:
+        cut = max(sample.rfind("\n"), sample.rfind("\r"))
+        return sample[:cut + 1] if cut >= 0 else ""
+    return sample
+
+
+def _sample_rows(text: str, delimiter: str, quotechar: str) -> list[list[str]]:
+    try:
+        return [
+            r for r in csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar)
+            if r and not all(norm(c) == "" for c in r)
+        ]
+    except csv.Error:
+        return []
+
+
+def sniff_quotechar(sample: str, delimiter: str) -> str:
+    if '"' in sample:
+        return '"'
+    d = re.escape(delimiter)
+    return "'" if re.search(rf"(^|{d})'[^']*'({d}|$)", sample, re.M) else '"'
+
+
+def sniff_delimiter(sample: str, quotechar: str = '"') -> str:
+    """
+    El separador con el que casi todas las filas tienen el ancho del header
+    (y el header más ancho); en empate gana el orden de CSV_DELIMITERS.
+    """
+    best, best_score = ",", None
+    for d in CSV_DELIMITERS:
+        rows = _sample_rows(sample, d, quotechar)
+        if not rows or len(rows[0]) < 2:
+            continue
+        ncols = len(rows[0])
+        body = rows[1:]
+        same = sum(len(r) == ncols for r in body) / len(body) if body else 1.0
+        score = (same >= CSV_SNIFF_CONSISTENCY, ncols, same)
+        if best_score is None or score > best_score:
+            best, best_score = d, score
+    return best
+
+
+def sniff_csv(file_bytes: bytes, encoding: str | None = None) -> dict:
+    """
+    Dialecto del CSV: encoding, delimiter, quotechar y ncols (ancho del
+    header, None si la muestra no alcanza a cubrirlo). Con encoding dado,
+    file_bytes puede ser solo el comienzo del archivo.
+    """
+    encoding = encoding or sniff_encoding(file_bytes)
+    truncated = len(file_bytes) > CSV_SNIFF_BYTES
+    sample = _complete_lines(file_bytes[:CSV_SNIFF_BYTES].decode(encoding, errors="ignore"), truncated)
+    quotechar = sniff_quotechar(sample, ",")
+    delimiter = sniff_delimiter(sample, quotechar)
+    if delimiter != ",":
+        quotechar = sniff_quotechar(sample, delimiter)
+    rows = _sample_rows(sample, delimiter, quotechar)
+    return {
+        "encoding": encoding,
+        "delimiter": delimiter,
+        "quotechar": quotechar,
+        "ncols": len(rows[0]) if rows else None,
+    }
+
+
+def read_csv_rows(text: str, delimiter: str = ",", quotechar: str = '"') -> list[list[str]]:
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter, quotechar=quotechar, skipinitialspace=False)
+
+    rows = []
+    for row in reader:
+        if not row:
+            continue
+        if all(norm(c) == "" for c in row):
+            continue
+        rows.append(row)
+    return rows
+
+
+def is_blank(v: str) -> bool:
+    """
+    norm(v) == "", sin normalizar lo que empieza con letra o número.
+    """
+    t = v.strip()
+    return not t or (not t[0].isalnum() and norm(t) == "")
+
+
+def align_rows(data: list[list[str]], ncols: int) -> list[list[str]]:
+    fixed = []
+    for r in data:
+        if len(r) > ncols:
+            r = r[:ncols]
+        elif len(r) < ncols:
+            r = r + ([""] * (ncols - len(r)))
+        fixed.append(r)
+    return fixed
+
+
+def read_csv_fast(file_bytes: bytes, dialect: dict) -> tuple[list[str], Columns]:
+    """
+    Lo mismo que read_csv_rows + align_rows, con el parser en C de pandas:
+    se leen CSV_EXTRA_COLS columnas de más (las filas cortas se rellenan con
+    ""; una fila todavía más ancha hace fallar la lectura) y después se
+    recorta al header. Las filas vacías (norm) se descartan columna por
+    columna, mirando solo las que siguen en duda: una fila con texto solo
+    después del header se conserva, como con csv.reader.
+    """
+    ncols = dialect["ncols"]
+    width = ncols + CSV_EXTRA_COLS
+    df = pd.read_csv(
+        io.BytesIO(file_bytes),
+        sep=dialect["delimiter"],
+        quotechar=dialect["quotechar"],
+        encoding=dialect["encoding"],
+        encoding_errors="replace",
+        header=None,
+        names=range(width),
+        dtype=object,
+        na_filter=False,
+        skip_blank_lines=True,
+        engine="c",
+    )
+    empty = np.arange(len(df))
+    for j in range(width):
+        if not len(empty):
+            break
+        codes, uniques = pd.factorize(df[j].to_numpy(dtype=object)[empty])
+        blank = np.fromiter((is_blank(u) for u in uniques), dtype=bool, count=len(uniques))
+        empty = empty[blank[codes]]
+    if len(empty) == len(df):
+        return [], Columns([])
+    cols = [df[j].to_numpy(dtype=object) for j in range(ncols)]
+    if len(empty):
+        cols = [np.delete(c, empty) for c in cols]
+    return [c[0] for c in cols], Columns([encode_column(c[1:]) for c in cols])
+
+
+@instrumented("parse_csv_robusto", rows=_parsed_rows)
+def parse_csv_robusto(file_bytes: bytes, dialect: dict | None = None):
+    dialect = dialect or sniff_csv(file_bytes)
+    if dialect["ncols"]:
+        try:
+            return read_csv_fast(file_bytes, dialect)
+        except (pd.errors.ParserError, ValueError, UnicodeError):
+            pass
+
+    # Header que no entra en la muestra o CSV que el parser en C no acepta
+    text = file_bytes.decode(dialect["encoding"], errors="replace")
+    rows = read_csv_rows(text, dialect["delimiter"], dialect["quotechar"])
+
+    if not rows:
+        return [], Columns([])
+
+    header = rows[0]
+    return header, Columns.from_rows(align_rows(rows[1:], len(header)), len(header))
+
+
+STREAM_CHUNK_ROWS = 5_000
+
+
+def open_binary(source):
+    """
+    bytes, ruta o archivo binario -> (archivo binario, cerrar_al_final).
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), True
+    if isinstance(source, (str, Path)):
+        return open(source, "rb"), True
+    source.seek(0)
+    return source, False
+
+
+def iter_csv_chunks(source, chunk_rows: int = STREAM_CHUNK_ROWS):
+    """
+    Versión por bloques de parse_csv_robusto: lee los bytes de a poco (sin
+    decodificar el archivo completo), alinea cada fila al header y produce
+    (header, Columns) cada chunk_rows filas. Si el CSV solo trae header se
+    produce un único bloque vacío; si está vacío no produce nada.
+    """
+    raw, owned = open_binary(source)
+    # Separador y comillas salen del comienzo; el encoding mira hasta el
+    # primer byte no ASCII, que puede venir mucho después
+    encoding = sniff_stream_encoding(raw)
+    dialect = sniff_csv(raw.read(CSV_SNIFF_BYTES), encoding)
+    raw.seek(0)
+    text = io.TextIOWrapper(raw, encoding=dialect["encoding"], errors="replace", newline="")
+    try:
+        reader = csv.reader(text, delimiter=dialect["delimiter"], quotechar=dialect["quotechar"], skipinitialspace=False)
+        header = None
+        ncols = 0
+        chunk = []
+        yielded = False
+        for row in reader:
+            if not row:
+                continue
+            if all(norm(c) == "" for c in row):
+                continue
+            if header is None:
+                header = row
+                ncols = len(header)
+                continue
+            if len(row) > ncols:
+                row = row[:ncols]
+            elif len(row) < ncols:
+                row = row + ([""] * (ncols - len(row)))
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                yield header, Columns.from_rows(chunk, ncols)
+                yielded = True
+                chunk = []
+        if header is not None and (chunk or not yielded):
+            yield header, Columns.from_rows(chunk, ncols)
+    finally:
+        if owned:
+            text.close()
+        else:
+            text.detach()
+
+
+# -----------------------------
+# Caché de parseo por contenido
+# -----------------------------
+PARSE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+def content_key(file_bytes: bytes) -> str:
+    return hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+
+
+def norm_column(values):
+    """
+    norm() de cada celda, evaluado una vez por valor distinto. Una columna
+    codificada queda codificada, con los mismos códigos.
+    """
+    if isinstance(values, Coded):
+        return values.map(norm)
+    if len(values) == 0:
+        return np.empty(0, dtype=object)
+    return np.asarray(factorize_values(values).map(norm))
+
+
+def norm_columns(data, ncols: int) -> Columns:
+    """
+    Las columnas con norm() aplicado, como otra tabla Columns.
+    """
+    return Columns([norm_column(column_data(data, j)) for j in range(ncols)])
+
+
+def build_table(file_bytes: bytes, dialect: dict | None = None) -> dict:
+    """
+    Tabla parseada de un CSV: header, filas, columnas normalizadas, códigos
+    SI/NO y perfil. Archivos de más de STREAM_THRESHOLD_BYTES quedan como
+    tabla por bloques (ver streamed_table).
+    """
+    if len(file_bytes) > STREAM_THRESHOLD_BYTES:
+        return streamed_table(file_bytes)
+
+    dialect = dialect or sniff_csv(file_bytes)
+    header, data = parse_csv_robusto(file_bytes, dialect)
+    profile, yesno = scan_columns(header, data)
+    return {
+        "header": header,
+        "dialecto": dialect,
+        "data": data,
+        "norm_cols": norm_columns(data, len(header)),
+        "yesno": yesno,
+        "profile": profile,
+        "nrows": len(data),
+        "nbytes": len(file_bytes),
+    }
+
+
+# Exportes acumulados: el de hoy es el de ayer más filas nuevas al final.
+# Se reconoce por el hash del encabezado y del prefijo, y solo se parsea la
+# cola (ver ParseCache._extend_previous).
+def header_key(file_bytes: bytes) -> str:
+    end = file_bytes.find(b"\n")
+    return content_key(file_bytes[:end + 1] if end >= 0 else file_bytes)
+
+
+def is_row_boundary(file_bytes: bytes, n: int, quotechar: str = '"') -> bool:
+    # Termina en salto de línea y fuera de comillas (comillas pares hasta ahí)
+    quote = quotechar.encode("ascii")
+    return 0 < n < len(file_bytes) and file_bytes[n - 1:n] == b"\n" and file_bytes.count(quote, 0, n) % 2 == 0
+
+
+def same_dialect(a: dict, b: dict) -> bool:
+    return all(a[k] == b[k] for k in ("encoding", "delimiter", "quotechar"))
+
+
+def extend_table(prev: dict, file_bytes: bytes) -> dict:
+    """
+    Tabla de file_bytes a partir de prev, cuyo archivo es un prefijo de
+    file_bytes: se parsean, normalizan y clasifican solo las filas nuevas.
+    El perfil queda igual al de parsear el archivo completo. Los arreglos de
+    duplicadas ya calculados para prev se extienden con la cola.
+    """
+    header = prev["header"]
+    ncols = len(header)
+    prev_n = prev["nrows"]
+    dialect = prev.get("dialecto", DEFAULT_DIALECT)
+    tail_text = file_bytes[prev["nbytes"]:].decode(dialect["encoding"], errors="replace")
+    tail = Columns.from_rows(align_rows(read_csv_rows(tail_text, dialect["delimiter"], dialect["quotechar"]), ncols), ncols)
+    tail_norm = norm_columns(tail, ncols)
+    _, tail_yesno = scan_columns(header, tail, samples=False)
+
+    data = Columns.concat([prev["data"], tail])
+    norm_cols = Columns.concat([prev["norm_cols"], tail_norm])
+    yesno = np.concatenate([prev["yesno"], tail_yesno], axis=1)
+
+    rows = []
+    for row in prev["profile"].to_dict("records"):
+        j = row["idx"]
+        _profile_counts(row, yesno[j])
+        row["distintos"] = len(set(factorize_values(norm_cols.column(j)).used()) - {""})
+        # Las muestras salen de las primeras filas: solo cambian si prev era corto
+        if prev_n < PROFILE_DT_SAMPLE:
+            row["fechas"] = datetime_hits(data.head(PROFILE_DT_SAMPLE)[j])
+        if prev_n < PROFILE_DISTRICT_SAMPLE and row["es_distrito"]:
+            row["score_distrito"] = district_score(data, j)
+        rows.append(row)
+
+    inputs = {}
+    for (dt_col, key_cols), (times, sig) in prev.get("dedupe_inputs", {}).items():
+        inputs[(dt_col, key_cols)] = (
+            np.concatenate([times, parse_datetimes(tail[dt_col])]),
+            np.concatenate([sig, row_signatures([tail_norm.column(j) for j in key_cols], normalized=True, nrows=len(tail))]),
+        )
+
+    return {
+        "header": header,
+        "dialecto": dialect,
+        "data": data,
+        "norm_cols": norm_cols,
+        "yesno": yesno,
+        "profile": pd.DataFrame(rows, columns=PROFILE_COLUMNS),
+        "nrows": len(data),
+        "nbytes": len(file_bytes),
+        "append_of": (prev["key"], prev_n),
+        "append_depth": prev.get("append_depth", 0) + 1,
+        "dedupe_inputs": inputs,
+    }
+
+
+class ParseCache:
+    """
+    Caché LRU de CSV ya parseados, indexada por el hash del contenido.
+    Cada entrada guarda header, filas alineadas, las columnas normalizadas,
+    los códigos SI/NO y el perfil de columnas, así un rerun solo vuelve a
+    procesar los archivos cuyos bytes cambiaron. Los archivos de más de
+    STREAM_THRESHOLD_BYTES quedan como tablas por bloques (bytes + perfil).
+    El límite se mide en bytes de los archivos fuente.
+    """
+
+    def __init__(self, max_bytes: int = PARSE_CACHE_MAX_BYTES, store: "ResultStore | None" = None):
+        self.max_bytes = max_bytes
+        self.store = store
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, file_bytes: bytes) -> dict:
+        entry, dialect = self.lookup(file_bytes)
+        if entry is None:
+            entry = self.add(file_bytes, build_table(file_bytes, dialect))
+        return entry
+
+    def lookup(self, file_bytes: bytes) -> tuple[dict | None, dict | None]:
+        """
+        (tabla, None) si sale sin parsear el archivo completo: de memoria, del
+        store o extendiendo un archivo anterior. Si no, (None, dialecto) y la
+        tabla de build_table se registra con add().
+        """
+        key = content_key(file_bytes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, None
+
+        entry = self.store.get_table(key) if self.store is not None else None
+        if entry is not None:
+            return self._insert(key, entry), None
+        dialect = sniff_csv(file_bytes)
+        entry = self._extend_previous(file_bytes, dialect)
+        if entry is not None:
+            return self.add(file_bytes, entry, key), None
+        return None, dialect
+
+    def add(self, file_bytes: bytes, entry: dict, key: str | None = None) -> dict:
+        """
+        Registra una tabla recién calculada (en memoria y en el store).
+        """
+        key = key or content_key(file_bytes)
+        entry["head_key"] = header_key(file_bytes)
+        if self.store is not None:
+            self.store.put_table(key, entry)
+            self.store.put_prefix(key, entry["head_key"], len(file_bytes))
+        return self._insert(key, entry)
+
+    def _insert(self, key: str, entry: dict) -> dict:
+        entry["key"] = key
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.total_bytes += entry["nbytes"]
+            self._evict()
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _extend_previous(self, file_bytes: bytes, dialect: dict) -> dict | None:
+        """
+        Si el archivo es uno ya procesado más filas al final (mismo
+        encabezado, mismo dialecto y el comienzo con el mismo hash), parsea
+        solo la cola.
+        """
+        # En UTF-16 los saltos de línea no son un byte: no se corta por bytes
+        if len(file_bytes) > STREAM_THRESHOLD_BYTES or dialect["encoding"] == "utf-16":
+            return None
+        head = header_key(file_bytes)
+        with self._lock:
+            candidates = [
+                (e["key"], e["nbytes"]) for e in self._entries.values()
+                if e.get("head_key") == head and e["nbytes"] < len(file_bytes)
+            ]
+        if self.store is not None:
+            candidates += self.store.prefix_candidates(head, len(file_bytes))
+
+        for prev_key, n in sorted(set(candidates), key=lambda c: -c[1]):
+            if not is_row_boundary(file_bytes, n, dialect["quotechar"]) or content_key(file_bytes[:n]) != prev_key:
+                continue
+            with self._lock:
+                prev = self._entries.get(prev_key)
+            if prev is None and self.store is not None:
+                prev = self.store.get_table(prev_key)
+            if (prev is not None and prev["header"] and not prev.get("streamed")
+                    and same_dialect(prev.get("dialecto", DEFAULT_DIALECT), dialect)):
+                prev["key"] = prev_key
+                return extend_table(prev, file_bytes)
+        return None
+
+    def _evict(self):
+        # Nunca se saca la entrada recién usada, aunque exceda el límite sola
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.total_bytes -= old["nbytes"]
+
+
+# -----------------------------
+# Almacén persistente (SQLite en .cache/)
+# -----------------------------
+# Sobrevive a reinicios y a un refresh del navegador, y lo comparten todas
+# las sesiones y procesos del servidor: tablas parseadas (con su perfil) por
+# hash del contenido y los resultados chicos de etapas (base por distrito y
+# reportes por delegación) por su clave. Es solo caché: si el disco falla se
+# recalcula. Los valores son pickles propios; no apuntarlo a archivos ajenos.
+STORE_FILE = "resultados.sqlite"
+STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+STORE_VERSION = 7
+# Un archivo extendido se guarda como las filas nuevas sobre el anterior;
+# pasada esta cadena de extensiones se guarda completo otra vez.
+STORE_DELTA_MAX_DEPTH = 30
+
+
+class ResultStore:
+    def __init__(self, path=None, max_bytes: int = STORE_MAX_BYTES):
+        self.path = Path(path) if path else Path(CACHE_DIR) / STORE_FILE
+        self.max_bytes = max_bytes
+        self.enabled = True
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with closing(self._connect()) as con, con:
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS entradas ("
+                    " tipo TEXT NOT NULL, clave TEXT NOT NULL, version INTEGER NOT NULL,"
+                    " nbytes INTEGER NOT NULL, usado REAL NOT NULL, valor BLOB NOT NULL,"
+                    " PRIMARY KEY (tipo, clave))"
+                )
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS prefijos ("
+                    " clave TEXT PRIMARY KEY, cabecera TEXT NOT NULL, nbytes INTEGER NOT NULL)"
+                )
+        except (OSError, sqlite3.Error):
+            self.enabled = False
+
+    def _connect(self):
+        # Una conexión por operación: sirve desde cualquier hilo o proceso
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, tipo: str, clave: str):
+        if not self.enabled:
+            return None
+        try:
+            with closing(self._connect()) as con, con:
+                row = con.execute(
+                    "SELECT valor FROM entradas WHERE tipo = ? AND clave = ? AND version = ?",
+                    (tipo, clave, STORE_VERSION)
+                ).fetchone()
+                if row is None:
+                    return None
+                con.execute("UPDATE entradas SET usado = ? WHERE tipo = ? AND clave = ?", (time.time(), tipo, clave))
+            return pickle.loads(zlib.decompress(row[0]))
+        except sqlite3.Error:
+            return None
+        except Exception:
+            # Entrada ilegible (de otra versión de pandas, cortada, ...): se recalcula
+            return None
+
+    def put(self, tipo: str, clave: str, value):
+        if not self.enabled:
+            return
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        try:
+            with closing(self._connect()) as con, con:
+                con.execute(
+                    "INSERT OR REPLACE INTO entradas (tipo, clave, version, nbytes, usado, valor) VALUES (?, ?, ?, ?, ?, ?)",
+                    (tipo, clave, STORE_VERSION, len(blob), time.time(), sqlite3.Binary(blob))
+                )
+                self._evict(con)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, con):
+        total = con.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entradas").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for tipo, clave, nbytes in con.execute("SELECT tipo, clave, nbytes FROM entradas ORDER BY usado").fetchall():
+            if total <= self.max_bytes:
+                break
+            con.execute("DELETE FROM entradas WHERE tipo = ? AND clave = ?", (tipo, clave))
+            if tipo == "tabla":
+                con.execute("DELETE FROM prefijos WHERE clave = ?", (clave,))
+            total -= nbytes
+
+    def get_table(self, key: str) -> dict | None:
+        value = self.get("tabla", key)
+        if value is None or not value.get("delta"):
+            return value
+
+        prev = self.get_table(value["append_of"][0])
+        if prev is None:
+            return None
+        value.pop("delta")
+        value["header"] = prev["header"]
+        value["data"] = Columns.concat([prev["data"], value["data"]])
+        value["norm_cols"] = Columns.concat([prev["norm_cols"], value["norm_cols"]])
+        value["yesno"] = np.concatenate([prev["yesno"], value["yesno"]], axis=1)
+        return value
+
+    def put_table(self, key: str, table: dict):
+        # Las tablas por bloques son los bytes del archivo: no se guardan
+        if table.get("streamed"):
+            return
+        value = {k: v for k, v in table.items() if k != "dedupe_inputs"}
+        prev = table.get("append_of")
+        if prev is not None and table.get("append_depth", 0) <= STORE_DELTA_MAX_DEPTH and self.has("tabla", prev[0]):
+            n = prev[1]
+            value.pop("header")
+            value.update(
+                delta=True,
+                data=table["data"].tail(n),
+                norm_cols=table["norm_cols"].tail(n),
+                yesno=table["yesno"][:, n:],
+            )
+        elif prev is not None:
+            # Guardada completa: la cadena vuelve a empezar desde esta tabla
+            table["append_depth"] = value["append_depth"] = 0
+        self.put("tabla", key, value)
+
+    def has(self, tipo: str, clave: str) -> bool:
+        if not self.enabled:
+            return False
+        try:
+            with closing(self._connect()) as con:
+                return con.execute(
+                    "SELECT 1 FROM entradas WHERE tipo = ? AND clave = ? AND version = ?",
+                    (tipo, clave, STORE_VERSION)
+                ).fetchone() is not None
+        except sqlite3.Error:
+            return False
+
+    def put_prefix(self, key: str, head_key: str, nbytes: int):
+        if not self.enabled:
+            return
+        try:
+            with closing(self._connect()) as con, con:
+                con.execute("INSERT OR REPLACE INTO prefijos (clave, cabecera, nbytes) VALUES (?, ?, ?)", (key, head_key, nbytes))
+        except sqlite3.Error:
+            pass
+
+    def prefix_candidates(self, head_key: str, max_nbytes: int) -> list[tuple[str, int]]:
+        """
+        Archivos ya guardados con el mismo encabezado y más cortos que
+        max_nbytes, como (clave, tamaño).
+        """
+        if not self.enabled:
+            return []
+        try:
+            with closing(self._connect()) as con:
+                return con.execute(
+                    "SELECT p.clave, p.nbytes FROM prefijos p JOIN entradas e ON e.tipo = 'tabla' AND e.clave = p.clave"
+                    " WHERE p.cabecera = ? AND p.nbytes < ?",
+                    (head_key, max_nbytes)
+                ).fetchall()
+        except sqlite3.Error:
+            return []
+
+    def clear(self):
+        if not self.enabled:
+            return
+        try:
+            with closing(self._connect()) as con, con:
+                con.execute("DELETE FROM entradas")
+                con.execute("DELETE FROM prefijos")
+            with closing(self._connect()) as con:
+                con.execute("VACUUM")
+        except sqlite3.Error:
+            pass
+
+
+# -----------------------------
+# Memo de etapas (recalcular solo lo que cambió)
+# -----------------------------
+# Cada etapa posterior al parseo (duplicadas, base por distrito, reporte con
+# catálogo) se memoriza por la versión de sus entradas. La versión de una
+# tabla es su "key": el hash del contenido para las que vienen de ParseCache
+# y (key madre, parámetros) para las derivadas. Cambiar la columna SI/NO
+# solo recalcula la base y el reporte de ese tipo; prender o apagar
+# duplicadas vuelve a una tabla ya calculada.
+STAGE_MEMO_MAX_ENTRIES = 64
+# Etapas con resultados chicos, que también van al ResultStore
+PERSISTED_STAGES = ("base", "reporte Comunidad", "reporte Comercio", "reporte Policial")
+
+
+class StageMemo:
+    def __init__(self, max_entries: int = STAGE_MEMO_MAX_ENTRIES, store: ResultStore | None = None):
+        self.max_entries = max_entries
+        self.store = store if store is not None and store.enabled else None
+        self.hits = {}
+        self.misses = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def run(self, stage: str, key, fn: Callable, *args, **kwargs):
+        """
+        Resultado de fn(*args, **kwargs) para (stage, key). Con key None no
+        se memoriza (entradas sin versión). El resultado es compartido: no
+        modificarlo.
+        """
+        if key is None:
+            return fn(*args, **kwargs)
+
+        full_key = (stage, key)
+        with self._lock:
+            if full_key in self._entries:
+                self._entries.move_to_end(full_key)
+                self.hits[stage] = self.hits.get(stage, 0) + 1
+                return self._entries[full_key]
+
+        persist = self.store is not None and stage in PERSISTED_STAGES
+        out = self.store.get(stage, repr(key)) if persist else None
+        if out is None:
+            out = fn(*args, **kwargs)
+            if persist:
+                self.store.put(stage, repr(key), out)
+            counter = self.misses
+        else:
+            counter = self.hits
+        with self._lock:
+            counter[stage] = counter.get(stage, 0) + 1
+            self._entries[full_key] = out
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return out
+
+    def peek(self, stage: str, key):
+        """
+        Resultado ya calculado (en memoria o en el store) o None, sin calcular.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            out = self._entries.get((stage, key))
+        if out is None and self.store is not None and stage in PERSISTED_STAGES:
+            out = self.store.get(stage, repr(key))
+        return out
+
+    def stats(self) -> pd.DataFrame:
+        stages = sorted(set(self.hits) | set(self.misses))
+        return pd.DataFrame({
+            "etapa": stages,
+            "aciertos": [self.hits.get(name, 0) for name in stages],
+            "recalculos": [self.misses.get(name, 0) for name in stages],
+        })
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+
+def table_version(table: dict | None):
+    """
+    Versión de una tabla para las claves del memo: () si no hay tabla y
+    None si la tabla no tiene clave (no se memoriza).
+    """
+    if not table:
+        return ()
+    return table.get("key")
+
+
+def _stage_key(*parts):
+    return None if any(p is None for p in parts) else parts
+
+
+# -----------------------------
+# Detectar columna Distrito
+# -----------------------------
+DISTRICT_TOKENS = ("distrito", "district")
+PROFILE_DISTRICT_SAMPLE = 200
+RE_NUMBERED = re.compile(r"^\d+\s*[\.\)]")
+
+
+def clean_header_token(h: str) -> str:
+    x = norm(h)
+    x = re.sub(r"^\s*\d+\s*[\.\)\-:]+\s*", "", x).strip()
+    x = x.rstrip(":").strip()
+    return x
+
+
+def _district_like(v) -> bool:
+    vv = normalize_visible_text(v)
+    if norm(vv) == "":
+        return False
+    if "?" in vv or ":" in vv:
+        return False
+    if len(vv) > 60:
+        return False
+    if RE_NUMBERED.match(vv):
+        return False
+    return True
+
+
+def district_score(data, col: int) -> int:
+    vals = factorize_values(column_data(head_rows(data, PROFILE_DISTRICT_SAMPLE), col))
+    if not len(vals):
+        return 0
+    good = np.fromiter((_district_like(v) for v in vals.dictionary), dtype=bool, count=len(vals.dictionary))
+    return int(good[vals.codes].sum())
+
+
+def find_district_col(header: list[str], data, profile: pd.DataFrame | None = None):
+    if profile is None:
+        profile = profile_columns(header, data)
+
+    candidates = profile[profile["es_distrito"]]
+    if candidates.empty:
+        return None
+
+    best = candidates["score_distrito"].idxmax()
+    return int(candidates.loc[best, "idx"])
+
+
+def get_unique_values(data, col_idx: int) -> list[str]:
+    vals = set()
+    for v in factorize_values(column_data(data, col_idx)).used():
+        if norm(v) != "":
+            vals.add(normalize_visible_text(v))
+    return sorted(list(vals), key=lambda x: strip_accents(x.lower()))
+
+
+# -----------------------------
+# Clasificación SI/NO (vectorizada)
+# -----------------------------
+YN_VACIO = 0
+YN_SI = 1
+YN_NO = 2
+YN_OTRO = 3
+
+
+def yesno_code(n: str) -> int:
+    """
+    Código SI/NO de un texto ya pasado por norm().
+    """
+    if n == "":
+        return YN_VACIO
+    if n == "si":
+        return YN_SI
+    if n == "no":
+        return YN_NO
+    return YN_OTRO
+
+
+def yesno_class(v) -> int:
+    return yesno_code(norm(v))
+
+
+def classify_yesno_column(values) -> np.ndarray:
+    """
+    Código int8 (vacío/si/no/otro) por celda. norm() corre una sola vez por
+    valor distinto; el resto es indexado de NumPy.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int8)
+    col = factorize_values(values)
+    lut = np.fromiter((yesno_class(u) for u in col.dictionary), dtype=np.int8, count=len(col.dictionary))
+    return lut[col.codes]
+
+
+# -----------------------------
+# Perfil de columnas (una sola pasada)
+# -----------------------------
+PROFILE_DT_SAMPLE = 300
+PROFILE_DISTINCT_CAP = 10_000
+CONSENT_TOKENS = ("acepta", "consent", "consentimiento")
+RE_HAS_DIGIT = re.compile(r"\d")
+
+PROFILE_COLUMNS = [
+    "idx", "columna", "token", "es_distrito", "es_consentimiento",
+    "no_vacias", "SI", "NO", "SI+NO", "ratio_SI_NO",
+    "distintos", "fechas", "score_distrito",
+]
+
+
+def datetime_hits(values) -> int:
+    """
+    Cuántos valores interpreta pd.to_datetime. Se parsea cada valor distinto
+    una vez (en orden de aparición, así la inferencia de formato es la misma);
+    una columna sin ningún dígito no puede traer fechas y se salta.
+    """
+    if len(values) == 0:
+        return 0
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+    uniques = [str(u) for u in uniques]
+    if not any(RE_HAS_DIGIT.search(u) for u in uniques):
+        return 0
+    with warnings.catch_warnings():
+        # Columnas de texto libre: pandas avisa que cae a dateutil valor por valor
+        warnings.simplefilter("ignore", UserWarning)
+        ok = pd.to_datetime(pd.Series(uniques), errors="coerce").notna().to_numpy()
+    return int(np.bincount(codes, minlength=len(uniques))[ok].sum())
+
+
+def _profile_counts(row: dict, codes: np.ndarray):
+    counts = np.bincount(codes, minlength=4)
+    filled = int(len(codes) - counts[YN_VACIO])
+    si = int(counts[YN_SI])
+    no = int(counts[YN_NO])
+    row["no_vacias"] = filled
+    row["SI"] = si
+    row["NO"] = no
+    row["SI+NO"] = si + no
+    row["ratio_SI_NO"] = ((si + no) / filled) if filled > 0 else 0.0
+
+
+def scan_columns(
+    header: list[str],
+    data,
+    distinct: list[set] | None = None,
+    samples: bool = True
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """
+    Recorre los datos una vez y devuelve el perfil de columnas junto con la
+    matriz (columnas x filas) de códigos SI/NO: yesno[j] es la columna j.
+    Cada columna se factoriza una sola vez (o ya viene codificada): de los
+    valores distintos salen los códigos SI/NO, la cardinalidad y las fechas.
+
+    Para lectura por bloques: distinct acumula los valores normalizados de
+    cada columna entre bloques (hasta PROFILE_DISTINCT_CAP) y samples=False
+    omite las muestras de fechas/distrito, que salen solo del primer bloque.
+    """
+    ncols = len(header)
+    yesno = np.zeros((ncols, len(data)), dtype=np.int8)
+
+    rows = []
+    for j, h in enumerate(header):
+        col = column_data(data, j) if len(data) else []
+        token = clean_header_token(h)
+        distintos = 0
+        if len(col):
+            col = factorize_values(col)
+            normed = [norm(u) for u in col.dictionary]
+            lut = np.fromiter((yesno_code(n) for n in normed), dtype=np.int8, count=len(normed))
+            yesno[j] = lut[col.codes]
+            # En una vista el diccionario puede traer valores sin filas
+            used = np.bincount(col.codes, minlength=len(normed)) > 0
+            normed = [n for n, u in zip(normed, used.tolist()) if u]
+            distintos = len(set(normed) - {""})
+            if distinct is not None and len(distinct[j]) < PROFILE_DISTINCT_CAP:
+                distinct[j].update(normed[:PROFILE_DISTINCT_CAP])
+
+        row = {
+            "idx": j,
+            "columna": h,
+            "token": token,
+            "es_distrito": token in DISTRICT_TOKENS,
+            "es_consentimiento": any(p in norm(h) for p in CONSENT_TOKENS),
+            "distintos": distintos,
+            "fechas": datetime_hits(col[:PROFILE_DT_SAMPLE]) if samples else 0,
+            "score_distrito": district_score(data, j) if samples and token in DISTRICT_TOKENS else 0,
+        }
+        _profile_counts(row, yesno[j])
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=PROFILE_COLUMNS), yesno
+
+
+def profile_columns(header: list[str], data) -> pd.DataFrame:
+    return scan_columns(header, data)[0]
+
+
+def refresh_profile(profile: pd.DataFrame, data, yesno: np.ndarray, norm_cols: Columns) -> pd.DataFrame:
+    """
+    Recalcula el perfil sobre un subconjunto de filas (p. ej. después de
+    deduplicar), igual que scan_stream con keep: conteos, cardinalidad y
+    muestras salen de las filas que quedan; el token, del header.
+    """
+    rows = []
+    for row in profile.to_dict("records"):
+        j = row["idx"]
+        _profile_counts(row, yesno[j])
+        row["distintos"] = len(set(factorize_values(norm_cols.column(j)).used()) - {""}) if len(data) else 0
+        row["fechas"] = datetime_hits(data.head(PROFILE_DT_SAMPLE)[j]) if len(data) else 0
+        if row["es_distrito"]:
+            row["score_distrito"] = district_score(data, j)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=PROFILE_COLUMNS)
+
+
+# -----------------------------
+# Ubicar SI/NO
+# -----------------------------
+def count_yesno(data, col: int, yesno: np.ndarray | None = None) -> tuple[int, int]:
+    codes = yesno[col] if yesno is not None else classify_yesno_column(column_data(data, col))
+    counts = np.bincount(codes, minlength=4)
+    return int(counts[YN_SI]), int(counts[YN_NO])
+
+
+@instrumented("rank_yesno_columns", rows=_data_rows)
+def rank_yesno_columns(
+    header: list[str],
+    data,
+    top_k: int = 8,
+    profile: pd.DataFrame | None = None
+) -> pd.DataFrame:
+    if profile is None:
+        profile = profile_columns(header, data)
+
+    df = profile[["idx", "columna", "SI", "NO", "SI+NO", "no_vacias", "ratio_SI_NO"]]
+    df = df.sort_values(["SI+NO", "ratio_SI_NO"], ascending=[False, False]).head(top_k).reset_index(drop=True)
+    return df
+
+
+def choose_default_yesno_col(
+    header: list[str],
+    data,
+    profile: pd.DataFrame | None = None
+) -> int:
+    if profile is None:
+        profile = profile_columns(header, data)
+
+    pref = profile[profile["es_consentimiento"]]
+    if not pref.empty:
+        # idxmax devuelve el primero en caso de empate, igual que antes
+        best = pref["SI+NO"].idxmax()
+        if pref.loc[best, "SI+NO"] > 0:
+            return int(pref.loc[best, "idx"])
+
+    ranked = rank_yesno_columns(header, data, top_k=1, profile=profile)
+    if len(ranked) == 0:
+        return 0
+    return int(ranked.loc[0, "idx"])
+
+
+# =========================================================
+# Deduplicación
+# =========================================================
+@instrumented("detect_datetime_col", rows=_data_rows)
+def detect_datetime_col(
+    header: list[str],
+    data,
+    profile: pd.DataFrame | None = None
+) -> int | None:
+    if not header:
+        return None
+    if profile is None:
+        if not data:
+            return None
+        profile = profile_columns(header, data)
+
+    best = profile["fechas"].idxmax()
+    if profile.loc[best, "fechas"] >= 5:
+        return int(profile.loc[best, "idx"])
+    return None
+
+
+NAT_NS = np.iinfo(np.int64).min
+SIG_SEED = np.uint64(0x345678)
+SIG_MULT = np.uint64(1000003)
+
+
+def parse_datetimes(values) -> np.ndarray:
+    """
+    Parseo vectorizado de fechas a int64 (ns, UTC); NaT queda como NAT_NS.
+    Cada valor distinto se parsea una vez: primero como ISO8601 (rápido) y
+    lo que no calce con format="mixed", que interpreta valor por valor igual
+    que pd.to_datetime sobre un escalar. Las fechas con zona horaria se
+    comparan por su instante UTC.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), use_na_sentinel=False)
+    uniques = pd.Series([str(u) for u in uniques], dtype=object)
+
+    parsed = pd.to_datetime(uniques, format="ISO8601", errors="coerce", utc=True)
+    missing = parsed.isna() & (uniques.str.strip() != "")
+    if missing.any():
+        parsed[missing] = pd.to_datetime(uniques[missing], format="mixed", errors="coerce", utc=True)
+
+    ns = parsed.dt.tz_localize(None).to_numpy(dtype="datetime64[ns]").view(np.int64)
+    return ns[codes]
+
+
+def row_signatures(columns: list, normalized: bool = False, nrows: int | None = None) -> np.ndarray:
+    """
+    Hash de 64 bits por fila de la firma (valor norm() de cada columna).
+    Cada columna se factoriza y solo se hashean sus valores distintos. Sin
+    columnas clave (archivo con solo la fecha) todas las filas tienen la
+    misma firma; nrows da la cantidad de filas en ese caso.
+    """
+    n = len(columns[0]) if columns else (nrows or 0)
+    sig = np.full(n, SIG_SEED, dtype=np.uint64)
+    for col in columns:
+        col = factorize_values(col)
+        uniques = col.dictionary if normalized else [norm(u) for u in col.dictionary]
+        hashed = pd.util.hash_array(np.asarray(uniques, dtype=object))
+        sig = (sig ^ hashed[col.codes]) * SIG_MULT
+    return sig
+
+
+DEDUPE_ANCHORED = "anchored"
+DEDUPE_SLIDING = "sliding"
+
+DEDUPE_GROUP_COLUMNS = ["fila", "respuestas", "eliminadas", "primera", "ultima", "firma"]
+
+
+def dedupe_keep(times: np.ndarray, sig: np.ndarray, minutes: int, mode: str = DEDUPE_ANCHORED) -> dict:
+    """
+    Núcleo del motor sobre arreglos compactos (fecha en ns y firma por fila).
+    Devuelve la máscara "keep", "removed" y los arreglos ordenados que usa
+    la estadística por grupo.
+    """
+    keep = np.ones(len(times), dtype=bool)
+    valid = np.flatnonzero(times != NAT_NS)
+    # Orden: firma, fecha y posición original (mismo orden que un sort estable por fecha)
+    order = valid[np.lexsort((valid, times[valid], sig[valid]))]
+    hs = sig[order]
+    ts = times[order]
+
+    window = minutes * 60 * 1_000_000_000
+    same = np.zeros(len(order), dtype=bool)
+    same[1:] = hs[1:] == hs[:-1]
+    # Candidata a duplicada: misma firma que la anterior y a <= window de ella.
+    # Si la brecha con la anterior es mayor, la fila se conserva seguro.
+    cand = same.copy()
+    cand[1:] &= (ts[1:] - ts[:-1]) <= window
+    keep_sorted = ~cand
+
+    if mode == DEDUPE_ANCHORED:
+        # Las cadenas de candidatas se resuelven contra la última fila conservada
+        anchor = 0
+        ts_list = ts.tolist()
+        for i in np.flatnonzero(cand).tolist():
+            if not cand[i - 1]:
+                anchor = ts_list[i - 1]
+            if ts_list[i] - anchor > window:
+                keep_sorted[i] = True
+                anchor = ts_list[i]
+
+    keep[order] = keep_sorted
+    return {
+        "keep": keep,
+        "removed": int(len(order) - keep_sorted.sum()),
+        "order": order,
+        "ts": ts,
+        "same": same,
+        "keep_sorted": keep_sorted,
+    }
+
+
+def _dedupe_result(nrows: int) -> dict:
+    return {
+        "keep": np.ones(nrows, dtype=bool),
+        "removed": 0,
+        "dt_col": None,
+        "key_cols": [],
+        "groups": pd.DataFrame(columns=DEDUPE_GROUP_COLUMNS),
+    }
+
+
+def _dedupe_key_cols(header: list[str], dt_col: int, key_cols: list[int] | None) -> list[int]:
+    key_cols = [j for j in (key_cols or []) if j != dt_col and 0 <= j < len(header)]
+    if not key_cols:
+        key_cols = [j for j in range(len(header)) if j != dt_col]
+    return key_cols
+
+
+def dedupe_engine(
+    header: list[str],
+    data,
+    minutes: int = 5,
+    key_cols: list[int] | None = None,
+    mode: str = DEDUPE_ANCHORED,
+    norm_cols: Columns | None = None,
+    profile: pd.DataFrame | None = None,
+    inputs: dict | None = None
+) -> dict:
+    """
+    Motor de duplicadas. Dos respuestas son la misma si coinciden (norm()) en
+    las columnas clave (por defecto todas salvo la fecha) y están a <= minutes.
+
+    - anchored: la ventana se mide desde la última respuesta conservada.
+    - sliding: se mide desde la respuesta anterior con la misma firma, aunque
+      se haya eliminado (una ráfaga larga se elimina completa).
+
+    Las filas sin fecha válida se conservan siempre. Devuelve un dict con la
+    máscara "keep", "removed", "dt_col", "key_cols" y "groups" (estadística
+    de cada firma que tuvo eliminaciones).
+    """
+    if mode not in (DEDUPE_ANCHORED, DEDUPE_SLIDING):
+        raise ValueError(f"Modo de ventana desconocido: {mode!r}")
+
+    result = _dedupe_result(len(data))
+    dt_col = detect_datetime_col(header, data, profile=profile)
+    if dt_col is None:
+        return result
+
+    key_cols = _dedupe_key_cols(header, dt_col, key_cols)
+    # inputs: fechas y firmas ya calculadas para (dt_col, key_cols), por tabla
+    cached = inputs.get((dt_col, tuple(key_cols))) if inputs is not None else None
+    if cached is not None:
+        times, sig = cached
+    else:
+        times = parse_datetimes(column_values(data, dt_col))
+        if norm_cols is not None:
+            sig = row_signatures([norm_cols.column(j) for j in key_cols], normalized=True, nrows=len(times))
+        else:
+            sig = row_signatures([column_data(data, j) for j in key_cols], nrows=len(times))
+        if inputs is not None:
+            inputs[(dt_col, tuple(key_cols))] = (times, sig)
+
+    core = dedupe_keep(times, sig, minutes, mode)
+    result.update(keep=core["keep"], removed=core["removed"], dt_col=dt_col, key_cols=key_cols)
+    if core["removed"]:
+        firsts = _dedupe_group_stats(core)["firsts"]
+        result["groups"] = _dedupe_groups(rows_at(data, firsts), key_cols, core)
+    return result
+
+
+def _dedupe_group_stats(core: dict) -> dict:
+    """
+    Tamaño, conservadas, inicio/fin (en el orden del núcleo) y primera fila
+    original de cada firma con eliminaciones.
+    """
+    order, same, keep_sorted = core["order"], core["same"], core["keep_sorted"]
+    group = np.cumsum(~same) - 1
+    ngroups = int(group[-1]) + 1
+    sizes = np.bincount(group, minlength=ngroups)
+    kept = np.bincount(group, weights=keep_sorted, minlength=ngroups).astype(int)
+    starts = np.flatnonzero(~same)
+    ends = np.r_[starts[1:], len(order)] - 1
+    hit = np.flatnonzero(sizes > kept)
+    return {
+        "sizes": sizes[hit],
+        "kept": kept[hit],
+        "starts": starts[hit],
+        "ends": ends[hit],
+        "firsts": order[starts[hit]],
+    }
+
+
+def _dedupe_groups(rows, key_cols: list[int], core: dict) -> pd.DataFrame:
+    """
+    rows: dict {índice: fila} con al menos las filas de
+    _dedupe_group_stats(core)["firsts"] (ver rows_at y fetch_rows).
+    """
+    ts = core["ts"]
+    g = _dedupe_group_stats(core)
+
+    out = []
+    for i in range(len(g["firsts"])):
+        first = int(g["firsts"][i])
+        firma = " | ".join(normalize_visible_text(rows[first][j]) for j in key_cols)
+        out.append({
+            "fila": first + 1,
+            "respuestas": int(g["sizes"][i]),
+            "eliminadas": int(g["sizes"][i] - g["kept"][i]),
+            "primera": pd.Timestamp(int(ts[g["starts"][i]])),
+            "ultima": pd.Timestamp(int(ts[g["ends"][i]])),
+            "firma": firma if len(firma) <= 120 else firma[:117] + "...",
+        })
+    df = pd.DataFrame(out, columns=DEDUPE_GROUP_COLUMNS)
+    return df.sort_values(["eliminadas", "fila"], ascending=[False, True]).reset_index(drop=True)
+
+
+def dedupe_mask(
+    header: list[str],
+    data,
+    minutes: int = 5,
+    norm_cols: Columns | None = None,
+    profile: pd.DataFrame | None = None
+) -> tuple[np.ndarray, int]:
+    """
+    Máscara booleana de filas a conservar con la regla original: firma sobre
+    todas las columnas salvo la fecha y ventana anclada.
+    """
+    res = dedupe_engine(header, data, minutes=minutes, norm_cols=norm_cols, profile=profile)
+    return res["keep"], res["removed"]
+
+
+def dedupe_table(
+    table: dict,
+    minutes: int = 5,
+    key_cols: list[int] | None = None,
+    mode: str = DEDUPE_ANCHORED,
+    memo: StageMemo | None = None
+) -> tuple[dict, dict]:
+    """
+    Corre el motor sobre una tabla ya parseada (usa sus columnas normalizadas
+    y su perfil, no re-parsea) y devuelve la tabla filtrada y el resultado.
+    En tablas por bloques no se copian filas: se guarda la máscara "keep".
+    La tabla filtrada tiene su propia "key" (la de la tabla y los parámetros).
+    """
+    if memo is not None:
+        key = _stage_key(table_version(table), minutes, tuple(key_cols or ()), mode)
+        return memo.run("duplicadas", key, dedupe_table, table, minutes, key_cols, mode)
+
+    out, res = _dedupe_table(table, minutes, key_cols, mode)
+    if out is not table and table.get("key") is not None:
+        out["key"] = (table["key"], "duplicadas", minutes, tuple(key_cols or ()), mode)
+    return out, res
+
+
+def _dedupe_table(table: dict, minutes: int, key_cols: list[int] | None, mode: str) -> tuple[dict, dict]:
+    if table.get("streamed"):
+        res = dedupe_stream(
+            table["source"], table["header"], table["profile"], table["nrows"],
+            minutes=minutes, key_cols=key_cols, mode=mode
+        )
+        if not res["removed"]:
+            return table, res
+        _, profile, nrows = scan_stream(table["source"], keep=res["keep"])
+        return dict(table, keep=res["keep"], profile=profile, nrows=nrows), res
+
+    res = dedupe_engine(
+        table["header"], table["data"], minutes=minutes, key_cols=key_cols, mode=mode,
+        norm_cols=table["norm_cols"], profile=table["profile"],
+        inputs=table.setdefault("dedupe_inputs", {})
+    )
+    if not res["removed"]:
+        return table, res
+    return take_table(table, np.flatnonzero(res["keep"])), res
+
+
+def take_table(table: dict, keep) -> dict:
+    """
+    Subconjunto de filas de una tabla parseada (dict con header, data,
+    norm_cols, yesno y profile), con los conteos del perfil recalculados.
+    data y norm_cols quedan como vistas de las de la tabla original.
+    """
+    data = table["data"].take(keep)
+    yesno = table["yesno"][:, keep]
+    out = dict(table)
+    # Lo que describe a la tabla completa no vale para el subconjunto
+    out.pop("append_of", None)
+    out.pop("append_depth", None)
+    out.pop("dedupe_inputs", None)
+    out["data"] = data
+    out["norm_cols"] = table["norm_cols"].take(keep)
+    out["yesno"] = yesno
+    out["profile"] = refresh_profile(table["profile"], data, yesno, out["norm_cols"])
+    out["nrows"] = len(data)
+    return out
+
+
+def dedupe_within_minutes(header: list[str], data, minutes: int = 5) -> tuple[list[list[str]] | Columns, int]:
+    keep, removed = dedupe_mask(header, data, minutes=minutes)
+    if not removed:
+        return data, 0
+    if isinstance(data, Columns):
+        return data.take(np.flatnonzero(keep)), removed
+    return [r for r, k in zip(data, keep) if k], removed
+
+
+# =========================================================
+# Catálogo de metas
+# =========================================================
+CATALOG_COLUMNS = ["Tipo", "Distrito", "Meta", "Distrito_key"]
+
+
+def read_catalog_xlsx(path: str) -> pd.DataFrame:
+    if not Path(path).exists():
+        return pd.DataFrame(columns=[
+            "Delegacion", "Tipo", "Distrito", "Meta",
+            "Delegacion_key", "Distrito_key"
+        ])
+
+    df = pd.read_excel(path)
+
+    df["Delegacion"] = df["Delegacion"].astype(str).apply(normalize_visible_text).apply(pretty_title)
+    df["Tipo"] = df["Tipo"].astype(str).apply(normalize_visible_text).apply(pretty_title)
+    df["Distrito"] = df["Distrito"].astype(str).apply(normalize_visible_text).apply(pretty_title)
+    df["Meta"] = pd.to_numeric(df["Meta"], errors="coerce").fillna(0).astype(int)
+
+    df = df[df["Delegacion"].apply(norm) != ""]
+    df = df[df["Tipo"].apply(norm) != ""]
+    df = df[df["Distrito"].apply(norm) != ""]
+
+    df["Delegacion_key"] = df["Delegacion"].apply(normalize_place_key)
+    df["Distrito_key"] = df["Distrito"].apply(normalize_place_key)
+
+    return df.reset_index(drop=True)
+
+
+def catalog_display_map(catalogo: pd.DataFrame) -> dict[str, str]:
+    """
+    Delegacion_key -> nombre oficial (la primera fila de cada delegación),
+    para resolver nombres visibles sin filtrar el catálogo cada vez.
+    """
+    if catalogo is None or catalogo.empty:
+        return {}
+    first = catalogo.drop_duplicates("Delegacion_key")
+    return dict(zip(first["Delegacion_key"], first["Delegacion"].astype(str)))
+
+
+def delegacion_display(display_map: dict[str, str], delegacion: str) -> str:
+    key = normalize_place_key(delegacion)
+    if key in display_map:
+        return display_map[key]
+    return pretty_title(delegacion)
+
+
+# -----------------------------
+# Catálogo indexado + snapshot binario
+# -----------------------------
+# Leer el xlsx con openpyxl es lento en cada arranque: el catálogo ya
+# normalizado e indexado se guarda en un pickle junto a su huella (tamaño,
+# mtime y hash del xlsx). Si el xlsx cambia, el snapshot se regenera.
+CACHE_DIR = ".cache"
+CATALOG_SNAPSHOT_VERSION = 1
+
+
+def file_digest(path) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_catalog_index(df: pd.DataFrame, fingerprint: dict | None = None) -> dict:
+    """
+    - "df": catálogo completo
+    - "por_tipo": {(Delegacion_key, Tipo): filas listas (CATALOG_COLUMNS, por Distrito)}
+    - "display": Delegacion_key -> nombre oficial
+    - "fingerprint": huella del xlsx de origen (su "digest" es la versión)
+    """
+    por_tipo = {}
+    if not df.empty:
+        for (d_key, tipo), g in df.groupby(["Delegacion_key", "Tipo"], sort=False):
+            por_tipo[(d_key, tipo)] = g[CATALOG_COLUMNS].sort_values("Distrito").reset_index(drop=True)
+    return {
+        "df": df,
+        "por_tipo": por_tipo,
+        "display": catalog_display_map(df),
+        "fingerprint": fingerprint or {},
+    }
+
+
+def _read_snapshot(path: Path) -> dict | None:
+    try:
+        with open(path, "rb") as fh:
+            snap = pickle.load(fh)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(snap, dict) or snap.get("version") != CATALOG_SNAPSHOT_VERSION:
+        return None
+    return snap
+
+
+def _write_snapshot(path: Path, index: dict):
+    # Mejor esfuerzo: si no se puede escribir (disco de solo lectura) se sigue sin snapshot
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as fh:
+            pickle.dump({"version": CATALOG_SNAPSHOT_VERSION, "index": index}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def load_catalog_index(path: str = "catalogo_metas.xlsx", cache_dir: str | None = CACHE_DIR) -> dict:
+    src = Path(path)
+    if not src.exists():
+        return build_catalog_index(read_catalog_xlsx(path))
+
+    stat = src.stat()
+    snap_path = Path(cache_dir) / f"{src.name}.snapshot.pkl" if cache_dir else None
+    snap = _read_snapshot(snap_path) if snap_path else None
+
+    digest = None
+    if snap is not None:
+        index = snap["index"]
+        fp = index["fingerprint"]
+        if fp.get("size") == stat.st_size and fp.get("mtime_ns") == stat.st_mtime_ns:
+            return index
+        # Mismo contenido con otra fecha (p. ej. un checkout): se reusa
+        digest = file_digest(src)
+        if fp.get("digest") == digest:
+            index["fingerprint"] = dict(fp, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            _write_snapshot(snap_path, index)
+            return index
+
+    fingerprint = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "digest": digest or file_digest(src),
+    }
+    index = build_catalog_index(read_catalog_xlsx(path), fingerprint)
+    if snap_path:
+        _write_snapshot(snap_path, index)
+    return index
+
+
+def catalog_lookup(index: dict, delegacion: str, tipo: str) -> pd.DataFrame:
+    """
+    Filas del catálogo (Tipo, Distrito, Meta, Distrito_key) de la delegación y
+    tipo: una búsqueda en el índice. El resultado es compartido: no
+    modificarlo (merge_base_with_catalog trabaja sobre una copia).
+    """
+    out = index["por_tipo"].get((normalize_place_key(delegacion), pretty_title(tipo)))
+    if out is None:
+        return pd.DataFrame(columns=CATALOG_COLUMNS)
+    return out
+
+
+def catalog_mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def map_distinct(values: pd.Series, fn) -> pd.Series:
+    """
+    fn aplicada una vez por valor distinto de la serie.
+    """
+    col = factorize_values(values.to_numpy(dtype=object)).map(fn)
+    return pd.Series(np.asarray(col), index=values.index)
+
+
+@instrumented("merge_base_with_catalog", rows=_result_rows)
+def merge_base_with_catalog(df_base: pd.DataFrame, df_cat: pd.DataFrame, tipo: str) -> pd.DataFrame:
+    if df_base is None or df_base.empty:
+        df_base = pd.DataFrame(columns=["Distrito", "SI", "NO", "Distrito_key"])
+    else:
+        df_base = df_base.copy()
+        df_base["Distrito"] = map_distinct(df_base["Distrito"], pretty_title)
+        df_base["Distrito_key"] = map_distinct(df_base["Distrito"], normalize_place_key)
+
+    if df_cat is None or df_cat.empty:
+        out = df_base.copy()
+        out["Tipo"] = pretty_title(tipo)
+        out["Meta"] = 0
+        out["SI"] = pd.to_numeric(out.get("SI", 0), errors="coerce").fillna(0).astype(int)
+        out["NO"] = pd.to_numeric(out.get("NO", 0), errors="coerce").fillna(0).astype(int)
+        if "Distrito_key" not in out.columns:
+            out["Distrito_key"] = out["Distrito"].apply(normalize_place_key)
+        return out[["Tipo", "Distrito", "Meta", "SI", "NO", "Distrito_key"]].sort_values("Distrito").reset_index(drop=True)
+
+    cat = df_cat.copy()
+    if "Distrito_key" not in cat.columns:
+        cat["Distrito_key"] = cat["Distrito"].apply(normalize_place_key)
+
+    base_agg = (
+        df_base.groupby("Distrito_key", as_index=False)
+        .agg({
+            "Distrito": "first",
+            "SI": "sum",
+            "NO": "sum"
+        })
+    )
+
+    out = cat.merge(base_agg[["Distrito_key", "SI", "NO"]], on="Distrito_key", how="left")
+    out["Tipo"] = pretty_title(tipo)
+    out["Meta"] = pd.to_numeric(out["Meta"], errors="coerce").fillna(0).astype(int)
+    out["SI"] = pd.to_numeric(out["SI"], errors="coerce").fillna(0).astype(int)
+    out["NO"] = pd.to_numeric(out["NO"], errors="coerce").fillna(0).astype(int)
+
+    return out[["Tipo", "Distrito", "Meta", "SI", "NO", "Distrito_key"]].sort_values("Distrito").reset_index(drop=True)
+
+
+# -----------------------------
+# Construir tablas base
+# -----------------------------
+RE_NUMBERED_ANSWER = re.compile(r"^\d+\.")
+
+
+def district_keys(values) -> tuple[np.ndarray, list[str], list[str]]:
+    """
+    Normaliza la columna de distrito una vez por valor distinto.
+    Devuelve (código de distrito por fila, claves, valor original de cada
+    clave). El código es -1 en filas que no cuentan: vacías, con "?" o que
+    son una opción numerada ("1. ...").
+    """
+    col = factorize_values(values)
+    uniques = [str(u) for u in col.dictionary]
+
+    keys = {}
+    key_of = np.empty(len(uniques), dtype=np.int64)
+    for i, u in enumerate(uniques):
+        k = normalize_place_key(u)
+        if k == "" or "?" in u or RE_NUMBERED_ANSWER.match(u.strip()):
+            key_of[i] = -1
+        else:
+            key_of[i] = keys.setdefault(k, len(keys))
+    return key_of[col.codes], list(keys), uniques
+
+
+@instrumented("build_base_comunidad", rows=_data_rows)
+def build_base_comunidad(header, data, col_yesno, yesno=None, profile=None):
+    dist_col = find_district_col(header, data, profile=profile)
+
+    if dist_col is None:
+        si, no = count_yesno(data, col_yesno, yesno)
+        return pd.DataFrame([{
+            "Tipo": "Comunidad",
+            "Distrito": "TOTAL (Delegación)",
+            "Distrito_key": normalize_place_key("TOTAL (Delegación)"),
+            "SI": si,
+            "NO": no
+        }])
+
+    yn = yesno[col_yesno] if yesno is not None else classify_yesno_column(column_data(data, col_yesno))
+    raw = column_data(data, dist_col)
+    row_key, keys, _ = district_keys(raw)
+
+    valid = row_key >= 0
+    if not valid.any():
+        return pd.DataFrame(columns=["Tipo", "Distrito", "Distrito_key", "SI", "NO"])
+
+    rows = np.flatnonzero(valid)
+    rk = row_key[rows]
+    yv = np.asarray(yn)[rows]
+    nkeys = len(keys)
+    si = np.bincount(rk, weights=(yv == YN_SI), minlength=nkeys).astype(int)
+    no = np.bincount(rk, weights=(yv == YN_NO), minlength=nkeys).astype(int)
+
+    # Orden de primera aparición y nombre visible de la primera fila de cada distrito
+    present, first = np.unique(rk, return_index=True)
+    by_first = np.argsort(first, kind="stable")
+    present, first = present[by_first], rows[first[by_first]]
+
+    df = pd.DataFrame({
+        "Tipo": "Comunidad",
+        "Distrito": [pretty_title(raw[i]) for i in first.tolist()],
+        "Distrito_key": [keys[k] for k in present.tolist()],
+        "SI": si[present],
+        "NO": no[present],
+    })
+    df = df.sort_values("Distrito").reset_index(drop=True)
+    return df
+
+
+def build_base_from_totals(tipo: str, distrito: str, si: int, no: int) -> pd.DataFrame:
+    return pd.DataFrame([{
+        "Tipo": pretty_title(tipo),
+        "Distrito": pretty_title(distrito),
+        "Distrito_key": normalize_place_key(distrito),
+        "SI": int(si),
+        "NO": int(no)
+    }])
+
+
+def meta_progress(meta, contabilidad) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Avance (fracción Contabilidad / Meta, 0 si no hay meta) y Pendiente
+    (nunca negativo), columna a columna.
+    """
+    meta = np.asarray(meta, dtype=np.int64)
+    contab = np.asarray(contabilidad, dtype=np.int64)
+    avance = np.zeros(len(meta), dtype=float)
+    np.divide(contab, meta, out=avance, where=meta > 0)
+    return avance, np.maximum(meta - contab, 0)
+
+
+def format_pct(avance) -> list[str]:
+    """
+    Solo para mostrar (pantalla y PDF): 0.734 -> "73%". En las tablas
+    "% Avance" queda numérico, así se puede ordenar y sumar.
+    """
+    pct = np.round(np.asarray(avance, dtype=float) * 100).astype(np.int64)
+    return [f"{p}%" for p in pct.tolist()]
+
+
+def apply_meta_calc_auto(df_base: pd.DataFrame, count_no_for_total: bool = False) -> pd.DataFrame:
+    df = df_base.copy()
+    df["Meta"] = pd.to_numeric(df.get("Meta", 0), errors="coerce").fillna(0).astype(int)
+    df["SI"] = pd.to_numeric(df.get("SI", 0), errors="coerce").fillna(0).astype(int)
+    df["NO"] = pd.to_numeric(df.get("NO", 0), errors="coerce").fillna(0).astype(int)
+
+    if count_no_for_total:
+        df["Contabilidad"] = (df["SI"] + df["NO"]).astype(int)
+    else:
+        df["Contabilidad"] = df["SI"].astype(int)
+
+    avance, pendiente = meta_progress(df["Meta"], df["Contabilidad"])
+    df["% Avance"] = avance
+    df["Pendiente"] = pendiente
+
+    keep_cols = ["Tipo", "Distrito", "Meta", "Contabilidad", "% Avance", "Pendiente", "SI", "NO"]
+    if "Distrito_key" in df.columns:
+        keep_cols.append("Distrito_key")
+
+    return df[keep_cols]
+
+
+# -----------------------------
+# Archivos grandes (lectura por bloques)
+# -----------------------------
+# Un export de cientos de MB no se decodifica ni se guarda como lista de
+# filas: la tabla queda como "streamed" (bytes + perfil) y cada etapa lo
+# recorre por bloques de STREAM_CHUNK_ROWS. La memoria pico depende del
+# tamaño del bloque; lo único por fila que se guarda son arreglos compactos
+# (fecha, firma y máscara para las duplicadas).
+STREAM_THRESHOLD_BYTES = 64 * 1024 * 1024
+
+
+def _iter_kept_chunks(source, keep: np.ndarray | None, chunk_rows: int):
+    offset = 0
+    for header, rows in iter_csv_chunks(source, chunk_rows):
+        if keep is not None:
+            mask = keep[offset:offset + len(rows)]
+            offset += len(rows)
+            rows = rows.take(np.flatnonzero(mask))
+        yield header, rows
+
+
+def scan_stream(source, keep: np.ndarray | None = None, chunk_rows: int = STREAM_CHUNK_ROWS) -> tuple[list[str], pd.DataFrame, int]:
+    """
+    Perfil de columnas por bloques (ver scan_columns). Devuelve header,
+    perfil y cantidad de filas (solo las de keep, si se indica).
+    """
+    header = []
+    first = None
+    counts = None
+    distinct = None
+    nrows = 0
+    for header, rows in _iter_kept_chunks(source, keep, chunk_rows):
+        if first is None:
+            distinct = [set() for _ in header]
+            counts = np.zeros((len(header), 4), dtype=np.int64)
+        prof, yesno = scan_columns(header, rows, distinct=distinct, samples=first is None)
+        if first is None:
+            first = prof
+        for j in range(len(header)):
+            counts[j] += np.bincount(yesno[j], minlength=4)
+        nrows += len(rows)
+
+    if first is None:
+        return [], pd.DataFrame(columns=PROFILE_COLUMNS), 0
+
+    rows = []
+    for row in first.to_dict("records"):
+        j = row["idx"]
+        c = counts[j]
+        filled = int(nrows - c[YN_VACIO])
+        row["no_vacias"] = filled
+        row["SI"] = int(c[YN_SI])
+        row["NO"] = int(c[YN_NO])
+        row["SI+NO"] = row["SI"] + row["NO"]
+        row["ratio_SI_NO"] = (row["SI+NO"] / filled) if filled > 0 else 0.0
+        row["distintos"] = len(distinct[j] - {""})
+        rows.append(row)
+    return header, pd.DataFrame(rows, columns=PROFILE_COLUMNS), nrows
+
+
+def fetch_rows(source, indices, chunk_rows: int = STREAM_CHUNK_ROWS) -> dict:
+    """
+    {índice: fila} para unas pocas filas de un CSV leído por bloques.
+    """
+    wanted = set(int(i) for i in indices)
+    found = {}
+    offset = 0
+    for _, rows in iter_csv_chunks(source, chunk_rows):
+        for i in wanted.intersection(range(offset, offset + len(rows))):
+            found[i] = rows.row(i - offset)
+        offset += len(rows)
+        if len(found) == len(wanted):
+            break
+    return found
+
+
+def dedupe_stream(
+    source,
+    header: list[str],
+    profile: pd.DataFrame,
+    nrows: int,
+    minutes: int = 5,
+    key_cols: list[int] | None = None,
+    mode: str = DEDUPE_ANCHORED,
+    chunk_rows: int = STREAM_CHUNK_ROWS
+) -> dict:
+    """
+    dedupe_engine por bloques: de cada bloque solo se guarda la fecha (int64)
+    y la firma (uint64) por fila; la máscara se resuelve al final.
+    """
+    if mode not in (DEDUPE_ANCHORED, DEDUPE_SLIDING):
+        raise ValueError(f"Modo de ventana desconocido: {mode!r}")
+
+    result = _dedupe_result(nrows)
+    dt_col = detect_datetime_col(header, None, profile=profile)
+    if dt_col is None:
+        return result
+
+    key_cols = _dedupe_key_cols(header, dt_col, key_cols)
+    times = []
+    sigs = []
+    for _, rows in iter_csv_chunks(source, chunk_rows):
+        times.append(parse_datetimes(rows[dt_col]))
+        sigs.append(row_signatures([rows.column(j) for j in key_cols], nrows=len(rows)))
+
+    core = dedupe_keep(np.concatenate(times), np.concatenate(sigs), minutes, mode)
+    result.update(keep=core["keep"], removed=core["removed"], dt_col=dt_col, key_cols=key_cols)
+    if core["removed"]:
+        firsts = _dedupe_group_stats(core)["firsts"]
+        result["groups"] = _dedupe_groups(fetch_rows(source, firsts, chunk_rows), key_cols, core)
+    return result
+
+
+def build_base_comunidad_stream(
+    source,
+    header: list[str],
+    col_yesno: int,
+    profile: pd.DataFrame,
+    keep: np.ndarray | None = None,
+    chunk_rows: int = STREAM_CHUNK_ROWS
+) -> pd.DataFrame:
+    """
+    build_base_comunidad por bloques: cada bloque se agrega por distrito y
+    los parciales se suman (el nombre visible es el de la primera aparición).
+    """
+    parts = [
+        build_base_comunidad(header, rows, col_yesno, profile=profile)
+        for _, rows in _iter_kept_chunks(source, keep, chunk_rows)
+    ]
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        if find_district_col(header, None, profile=profile) is None:
+            return build_base_comunidad(header, Columns.from_rows([], len(header)), col_yesno, profile=profile)
+        return pd.DataFrame(columns=["Tipo", "Distrito", "Distrito_key", "SI", "NO"])
+    return combine_bases(parts)
+
+
+def combine_bases(parts: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Suma bases por distrito de tramos consecutivos de filas (en orden): el
+    nombre visible es el del primer tramo donde aparece el distrito.
+    """
+    df = (
+        pd.concat(parts, ignore_index=True)
+        .groupby("Distrito_key", sort=False, as_index=False)
+        .agg({"Tipo": "first", "Distrito": "first", "SI": "sum", "NO": "sum"})
+    )
+    df = df[["Tipo", "Distrito", "Distrito_key", "SI", "NO"]]
+    return df.sort_values("Distrito").reset_index(drop=True)
+
+
+def streamed_table(source, nbytes: int | None = None) -> dict:
+    header, profile, nrows = scan_stream(source)
+    return {
+        "header": header,
+        "data": None,
+        "norm_cols": None,
+        "yesno": None,
+        "profile": profile,
+        "nrows": nrows,
+        "streamed": True,
+        "source": source,
+        "keep": None,
+        "nbytes": nbytes if nbytes is not None else len(source),
+    }
+
+
+# -----------------------------
+# Operaciones sobre tablas (en memoria o por bloques)
+# -----------------------------
+def table_yesno_counts(table: dict, col: int) -> tuple[int, int]:
+    """
+    SI/NO de una columna, leídos del perfil (que ya refleja las duplicadas).
+    """
+    row = table["profile"].iloc[col]
+    return int(row["SI"]), int(row["NO"])
+
+
+def table_base_comunidad(table: dict, col_yesno: int, memo: StageMemo | None = None) -> pd.DataFrame:
+    if memo is not None:
+        return memo.run("base", _stage_key(table_version(table), col_yesno), _table_base_comunidad, table, col_yesno, memo)
+    return _table_base_comunidad(table, col_yesno, None)
+
+
+def _table_base_comunidad(table: dict, col_yesno: int, memo: StageMemo | None) -> pd.DataFrame:
+    # Archivo extendido: base anterior + base de las filas nuevas. Con al
+    # menos PROFILE_DISTRICT_SAMPLE filas previas la columna de distrito es
+    # la misma que se eligió para el archivo anterior.
+    prev = table.get("append_of")
+    if memo is not None and prev is not None and prev[1] >= PROFILE_DISTRICT_SAMPLE:
+        prev_base = memo.peek("base", _stage_key(prev[0], col_yesno))
+        if prev_base is not None:
+            n = prev[1]
+            tail = build_base_comunidad(
+                table["header"], table["data"].tail(n), col_yesno,
+                yesno=table["yesno"][:, n:], profile=table["profile"]
+            )
+            parts = [p for p in (prev_base, tail) if not p.empty]
+            if parts:
+                return combine_bases(parts)
+
+    if table.get("streamed"):
+        return build_base_comunidad_stream(
+            table["source"], table["header"], col_yesno, table["profile"], keep=table.get("keep")
+        )
+    return build_base_comunidad(
+        table["header"], table["data"], col_yesno, yesno=table["yesno"], profile=table["profile"]
+    )
+
+
+# -----------------------------
+# Pool de procesos compartido
+# -----------------------------
+# Parseo, normalización y render son Python puro: con hilos no se reparten
+# entre núcleos. Los procesos arrancan con spawn (no heredan los hilos de
+# Streamlit) y el pool se crea una vez por proceso: cada worker importa
+# pandas y reportlab una sola vez y lo reusan todas las sesiones y lotes.
+_POOL = None
+_POOL_SIZE = 0
+_POOL_LOCK = threading.Lock()
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    El pool compartido, con al menos max_workers procesos. Se recrea si se
+    pide uno más grande (el CLI con --procesos); lo ya enviado al anterior
+    termina igual.
+    """
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL_SIZE < max_workers:
+            _POOL.shutdown(wait=False)
+            _POOL = None
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+            _POOL_SIZE = max_workers
+        return _POOL
+
+
+def reset_process_pool(pool: ProcessPoolExecutor):
+    """
+    Descarta pool (si sigue siendo el compartido): el próximo process_pool
+    crea otro.
+    """
+    global _POOL, _POOL_SIZE
+    with _POOL_LOCK:
+        if _POOL is pool:
+            _POOL = None
+            _POOL_SIZE = 0
+    pool.shutdown(wait=False)
+
+
+def submit_pool_task(max_workers: int, fn: Callable, *args):
+    """
+    fn(*args) en el pool compartido. Si un worker murió el pool queda roto y
+    submit lanza BrokenProcessPool: se descarta, se crea otro y se reintenta.
+    """
+    pool = process_pool(max_workers)
+    try:
+        return pool.submit(fn, *args)
+    except BrokenProcessPool:
+        reset_process_pool(pool)
+        return process_pool(max_workers).submit(fn, *args)
+
+
+# -----------------------------
+# Ingesta de varios archivos
+# -----------------------------
+INGEST_WORKERS = min(8, os.cpu_count() or 1)
+# Arrancar el pool (procesos que importan pandas) cuesta segundos: por debajo
+# de esto los archivos que faltan se parsean en el proceso principal.
+INGEST_POOL_MIN_BYTES = 8 * 1024 * 1024
+
+
+def build_table_task(file_bytes: bytes, dialect: dict, memory: bool = False) -> tuple[dict, float, list[dict]]:
+    """
+    build_table dentro del pool: (tabla, segundos, mediciones de etapas).
+    Una tabla por bloques vuelve sin los bytes (el proceso principal ya los
+    tiene).
+    """
+    STAGE_METRICS.set_memory(memory)
+    since = STAGE_METRICS.mark()
+    t0 = time.perf_counter()
+    table = build_table(file_bytes, dialect)
+    if table.get("streamed"):
+        table["source"] = None
+    return table, time.perf_counter() - t0, STAGE_METRICS.raw(since)
+
+
+def _ingest_result(name: str, table: dict | None, seconds: float, error: Exception | None = None) -> dict:
+    tipo, lugar = infer_tipo_lugar(name) if error is None else (None, None)
+    return {
+        "name": name,
+        "tipo": tipo,
+        "lugar": lugar,
+        "table": table,
+        "error": f"{type(error).__name__}: {error}" if error is not None else None,
+        "seconds": seconds,
+    }
+
+
+def ingest_files(
+    files: list[tuple[str, bytes]],
+    cache: ParseCache | None = None,
+    max_workers: int = INGEST_WORKERS
+) -> list[dict]:
+    """
+    Tabla parseada y perfilada de varios (nombre, bytes). Lo que ya está en
+    caché (o es un archivo anterior más filas) se resuelve acá; el resto se
+    parsea en el pool de procesos si son al menos dos y suman
+    INGEST_POOL_MIN_BYTES. El orden del
+    resultado es el de entrada; si un archivo falla se reporta en su
+    "error" (con "table" en None) y el resto del lote sigue. "seconds" es
+    el tiempo de cada archivo (en el pool, el del worker).
+    """
+    out = [None] * len(files)
+    misses = []
+    for i, (name, file_bytes) in enumerate(files):
+        t0 = time.perf_counter()
+        try:
+            table, dialect = cache.lookup(file_bytes) if cache is not None else (None, sniff_csv(file_bytes))
+        except Exception as e:
+            out[i] = _ingest_result(name, None, time.perf_counter() - t0, e)
+            continue
+        if table is not None:
+            out[i] = _ingest_result(name, table, time.perf_counter() - t0)
+        else:
+            misses.append((i, dialect, time.perf_counter() - t0))
+
+    def finish(i, table, seconds):
+        name, file_bytes = files[i]
+        t0 = time.perf_counter()
+        if table.get("streamed"):
+            table["source"] = file_bytes
+        if cache is not None:
+            table = cache.add(file_bytes, table)
+        out[i] = _ingest_result(name, table, seconds + time.perf_counter() - t0)
+
+    miss_bytes = sum(len(files[i][1]) for i, _, _ in misses)
+    if max_workers > 1 and len(misses) > 1 and miss_bytes >= INGEST_POOL_MIN_BYTES:
+        futures = [
+            (i, spent, submit_pool_task(max_workers, build_table_task, files[i][1], dialect, STAGE_METRICS.memory))
+            for i, dialect, spent in misses
+        ]
+        for i, spent, fut in futures:
+            try:
+                table, seconds, etapas = fut.result()
+                STAGE_METRICS.extend(etapas)
+                finish(i, table, spent + seconds)
+            except Exception as e:
+                out[i] = _ingest_result(files[i][0], None, spent, e)
+    else:
+        for i, dialect, spent in misses:
+            t0 = time.perf_counter()
+            try:
+                finish(i, build_table(files[i][1], dialect), spent + time.perf_counter() - t0)
+            except Exception as e:
+                out[i] = _ingest_result(files[i][0], None, spent + time.perf_counter() - t0, e)
+    return out
+
+
+# -----------------------------
+# PDF
+# -----------------------------
+# El logo (PNG de ~840 px con transparencia) se dibuja a 2.8": ReportLab lo
+# decodificaba y recomprimía en cada PDF. Se prepara una sola vez por
+# archivo: reducido al tamaño impreso, sobre blanco y como JPEG, que
+# ReportLab embebe tal cual. Los estilos tampoco cambian entre reportes.
+LOGO_SIZE_INCH = 2.8
+LOGO_DPI = 200
+
+
+@lru_cache(maxsize=4)
+def _prepared_logo(path: str, mtime_ns: int) -> bytes:
+    px = int(LOGO_SIZE_INCH * LOGO_DPI)
+    with PILImage.open(path) as im:
+        im = im.convert("RGBA").resize((px, px), PILImage.LANCZOS)
+    flat = PILImage.new("RGB", im.size, "white")
+    flat.paste(im, mask=im.getchannel("A"))
+    buff = io.BytesIO()
+    flat.save(buff, "JPEG", quality=90)
+    return buff.getvalue()
+
+
+def logo_flowable(logo_path: str | None):
+    if not logo_path:
+        return None
+    try:
+        mtime_ns = os.stat(logo_path).st_mtime_ns
+    except OSError:
+        return None
+    img = RLImage(io.BytesIO(_prepared_logo(str(logo_path), mtime_ns)), width=LOGO_SIZE_INCH * inch, height=LOGO_SIZE_INCH * inch)
+    img.hAlign = "CENTER"
+    return img
+
+
+@lru_cache(maxsize=1)
+def pdf_styles() -> dict:
+    styles = getSampleStyleSheet()
+    return {
+        "Title": styles["Title"],
+        "Normal": styles["Normal"],
+        "Heading2": styles["Heading2"],
+        "cell": ParagraphStyle("cell", parent=styles["Normal"], fontName="Helvetica", fontSize=9, leading=11),
+        "head": ParagraphStyle("head", parent=styles["Normal"], fontName="Helvetica-Bold", fontSize=9, leading=11),
+    }
+
+
+@instrumented("build_pdf_bytes", rows=_pdf_rows)
+def build_pdf_bytes(
+    delegacion_label: str,
+    hora_reporte: str,
+    fecha_str: str,
+    logo_path: str | None,
+    df_com: pd.DataFrame,
+    df_con: pd.DataFrame,
+    df_pol: pd.DataFrame
+) -> bytes:
+    buff = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buff,
+        pagesize=letter,
+        leftMargin=28,
+        rightMargin=28,
+        topMargin=28,
+        bottomMargin=28
+    )
+    styles = pdf_styles()
+    cell = styles["cell"]
+    head = styles["head"]
+
+    story = []
+
+    img = logo_flowable(logo_path)
+    if img is not None:
+        story.append(img)
+        story.append(Spacer(1, 8))
+
+    story.append(Paragraph(f"<b>{delegacion_label}</b>", styles["Title"]))
+    story.append(Spacer(1, 4))
+    story.append(Paragraph(f"<b>Hora del reporte:</b> {hora_reporte or '-'}", styles["Normal"]))
+    story.append(Paragraph(f"<b>Fecha:</b> {fecha_str}", styles["Normal"]))
+    story.append(Spacer(1, 10))
+
+    def make_table(df: pd.DataFrame, place_label: str):
+        cols = ["Tipo", place_label, "Meta", "Contabilidad", "% Avance", "Pendiente"]
+        data = [[Paragraph(c, head) for c in cols]]
+
+        rows = zip(
+            df["Tipo"].astype(str),
+            df["Distrito"].astype(str),
+            pd.to_numeric(df["Meta"], errors="coerce").astype(int).tolist(),
+            pd.to_numeric(df["Contabilidad"], errors="coerce").astype(int).tolist(),
+            format_pct(df["% Avance"]),
+            pd.to_numeric(df["Pendiente"], errors="coerce").astype(int).tolist(),
+        )
+        for row in rows:
+            data.append([Paragraph(str(v), cell) for v in row])
+
+        tbl = Table(
+            data,
+            colWidths=[62, 210, 55, 78, 58, 62],
+            repeatRows=1
+        )
+        tbl.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#E6E6E6")),
+            ("GRID", (0, 0), (-1, -1), 0.6, colors.black),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+            ("ALIGN", (2, 1), (-1, -1), "CENTER"),
+            ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#FAFAFA")]),
+            ("TOPPADDING", (0, 0), (-1, -1), 4),
+            ("BOTTOMPADDING", (0, 0), (-1, -1), 4),
+        ]))
+        return tbl
+
+    def section(title: str, df: pd.DataFrame, place_label: str = "Distrito", keep_block: bool = False):
+        if df is None or df.empty:
+            block = [
+                Paragraph(f"<b>{title}</b>", styles["Heading2"]),
+                Spacer(1, 4),
+                Paragraph("No hay registros.", styles["Normal"]),
+                Spacer(1, 12),
+            ]
+            if keep_block:
+                story.append(KeepTogether(block))
+            else:
+                story.extend(block)
+            return
+
+        tbl = make_table(df, place_label)
+
+        block = [
+            Paragraph(f"<b>{title}</b>", styles["Heading2"]),
+            Spacer(1, 4),
+            tbl,
+            Spacer(1, 12),
+        ]
+
+        if keep_block:
+            story.append(KeepTogether(block))
+        else:
+            story.extend(block)
+
+    section("Comunidad", df_com, place_label="Distrito", keep_block=False)
+    section("Comercio", df_con, place_label="Delegación", keep_block=True)
+    section("Policial", df_pol, place_label="Delegación", keep_block=True)
+
+    doc.build(story)
+    buff.seek(0)
+    return buff.getvalue()
+
+
+# -----------------------------
+# Reporte de una delegación (sin UI)
+# -----------------------------
+REPORT_TIPOS = ("Comunidad", "Comercio", "Policial")
+
+
+def catalog_version(cat_index: dict):
+    return cat_index["fingerprint"].get("digest", "")
+
+
+def report_comunidad(
+    cat_index: dict,
+    delegacion: str,
+    table: dict | None,
+    col_yesno: int | None,
+    memo: StageMemo | None = None
+) -> pd.DataFrame:
+    if memo is None:
+        return _report_comunidad(cat_index, delegacion, table, col_yesno, None)
+    key = _stage_key(table_version(table), col_yesno, catalog_version(cat_index), delegacion)
+    return memo.run("reporte Comunidad", key, _report_comunidad, cat_index, delegacion, table, col_yesno, memo)
+
+
+def _report_comunidad(cat_index, delegacion, table, col_yesno, memo) -> pd.DataFrame:
+    df_cat = catalog_lookup(cat_index, delegacion, "Comunidad")
+
+    if table and table["nrows"] and col_yesno is not None:
+        base = table_base_comunidad(table, col_yesno, memo=memo)
+    else:
+        base = pd.DataFrame(columns=["Tipo", "Distrito", "Distrito_key", "SI", "NO"])
+
+    base = merge_base_with_catalog(base, df_cat, "Comunidad")
+    return apply_meta_calc_auto(base)
+
+
+def report_from_totals(
+    cat_index: dict,
+    delegacion: str,
+    tipo: str,
+    table: dict | None,
+    col_yesno: int | None,
+    memo: StageMemo | None = None
+) -> pd.DataFrame:
+    """
+    Comercio y Policial: una sola fila con los totales SI/NO del archivo.
+    En Policial el NO también cuenta para el total.
+    """
+    if memo is None:
+        return _report_from_totals(cat_index, delegacion, tipo, table, col_yesno)
+    key = _stage_key(table_version(table), col_yesno, catalog_version(cat_index), delegacion)
+    return memo.run(f"reporte {tipo}", key, _report_from_totals, cat_index, delegacion, tipo, table, col_yesno)
+
+
+def _report_from_totals(cat_index, delegacion, tipo, table, col_yesno) -> pd.DataFrame:
+    df_cat = catalog_lookup(cat_index, delegacion, tipo)
+
+    si, no = 0, 0
+    if table and table["nrows"] and col_yesno is not None:
+        si, no = table_yesno_counts(table, col_yesno)
+
+    if not df_cat.empty:
+        distrito = df_cat.iloc[0]["Distrito"]
+    else:
+        distrito = delegacion
+
+    base = build_base_from_totals(tipo, distrito, si, no)
+    base = merge_base_with_catalog(base, df_cat, tipo)
+    return apply_meta_calc_auto(base, count_no_for_total=(tipo == "Policial"))
+
+
+# -----------------------------
+# Pool de render de PDF
+# -----------------------------
+# El layout de ReportLab es CPU puro y en un lote se lleva casi todo el
+# tiempo: los PDF se reparten en el pool de procesos compartido (ver
+# process_pool), con una cola acotada para no juntar en memoria los datos
+# de todas las delegaciones a la vez. Con tope, como INGEST_WORKERS: en un
+# servidor grande más procesos solo suman imports de pandas y reportlab.
+PDF_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def render_pdf_job(job: dict) -> dict:
+    """
+    job["pdf_args"]: argumentos de build_pdf_bytes. Si trae "pdf_path", el PDF
+    se escribe ahí (en el proceso que lo genera) y no viaja de vuelta.
+    Devuelve "pdf" (bytes o None), "pdf_s" y "error". Con job["metricas"]
+    (dentro del pool) devuelve también las mediciones de "etapas".
+    """
+    t0 = time.perf_counter()
+    out = {"pdf": None, "pdf_s": 0.0, "error": ""}
+    if job.get("metricas"):
+        STAGE_METRICS.set_memory(job.get("memoria", False))
+    since = STAGE_METRICS.mark()
+    try:
+        pdf = build_pdf_bytes(**job["pdf_args"])
+        if job.get("pdf_path"):
+            Path(job["pdf_path"]).write_bytes(pdf)
+        else:
+            out["pdf"] = pdf
+    except Exception as e:
+        out["error"] = f"{type(e).__name__}: {e}"
+    out["pdf_s"] = time.perf_counter() - t0
+    if job.get("metricas"):
+        out["etapas"] = STAGE_METRICS.raw(since)
+    return out
+
+
+def render_pdfs(
+    jobs: Iterable[dict],
+    max_workers: int = PDF_WORKERS,
+    max_pending: int | None = None
+) -> Iterator[dict]:
+    """
+    Aplica render_pdf_job a cada job y lo devuelve actualizado, en el orden
+    de entrada. Los jobs sin "pdf_args" (o con "error") pasan de largo.
+    Nunca hay más de max_pending (2 por proceso) en vuelo.
+    """
+    def merge(job, res):
+        job.pop("pdf_args", None)
+        job["pdf"] = res["pdf"]
+        job["pdf_s"] = res["pdf_s"]
+        STAGE_METRICS.extend(res.get("etapas", ()))
+        if res["error"]:
+            job["error"] = res["error"]
+        return job
+
+    if max_workers <= 1:
+        for job in jobs:
+            if job.get("pdf_args") and not job.get("error"):
+                job = merge(job, render_pdf_job(job))
+            yield job
+        return
+
+    max_pending = max_pending or 2 * max_workers
+    pending = deque()
+
+    def drain_one():
+        job, fut = pending.popleft()
+        if fut is None:
+            return job
+        try:
+            res = fut.result()
+        except Exception as e:
+            res = {"pdf": None, "pdf_s": 0.0, "error": f"{type(e).__name__}: {e}"}
+        return merge(job, res)
+
+    for job in jobs:
+        fut = None
+        if job.get("pdf_args") and not job.get("error"):
+            task = {
+                "pdf_args": job["pdf_args"],
+                "pdf_path": job.get("pdf_path"),
+                "metricas": True,
+                "memoria": STAGE_METRICS.memory,
+            }
+            fut = submit_pool_task(max_workers, render_pdf_job, task)
+        pending.append((job, fut))
+        while len(pending) >= max_pending:
+            yield drain_one()
+    while pending:
+        yield drain_one()
+
+
+# -----------------------------
+# Reportes por lote (todas las delegaciones)
+# -----------------------------
+BATCH_SUMMARY_COLUMNS = [
+    "Delegación", "archivo_pdf", "archivos", "filas", "duplicadas",
+    "lectura_s", "calculo_s", "pdf_s", "total_s", "error",
+]
+# Los CSV se parsean por grupos de delegaciones (todos los del grupo juntos
+# en el pool): alcanza para ocupar los procesos sin tener en memoria las
+# tablas de todo el lote.
+BATCH_INGEST_DELEGATIONS = 16
+
+
+def pdf_file_name(delegacion: str, when: datetime | None = None) -> str:
+    when = when or datetime.now()
+    return f"Reporte_{delegacion.replace(' ', '_')}_{when.strftime('%Y%m%d')}.pdf"
+
+
+def batch_delegations(upload_index: dict, cat_index: dict, include_catalog: bool = True) -> list[tuple[str, str]]:
+    """
+    (clave, nombre a mostrar) de cada delegación con CSV subidos y, si
+    include_catalog, también de las que solo están en el catálogo. Ordenadas
+    como el selector de la UI.
+    """
+    display = cat_index["display"]
+    out = {}
+    for lugar in upload_index["lugares"]:
+        out.setdefault(normalize_place_key(lugar), delegacion_display(display, lugar))
+    if include_catalog:
+        for key, name in display.items():
+            out.setdefault(key, name)
+    return sorted(out.items(), key=lambda kv: strip_accents(kv[1].lower()))
+
+
+def iter_batch_reports(
+    names: list[str],
+    read_bytes: Callable[[int], bytes],
+    cat_index: dict,
+    cache: ParseCache | None = None,
+    hora_reporte: str = "",
+    fecha_str: str | None = None,
+    logo_path: str | None = None,
+    dedupe: dict[str, bool] | None = None,
+    dedupe_minutes: int = 5,
+    dedupe_mode: str = DEDUPE_ANCHORED,
+    include_catalog: bool = True,
+    pdf_workers: int = 1,
+    out_dir=None
+) -> Iterator[dict]:
+    """
+    Genera el PDF de cada delegación. Las tablas se arman de a una
+    delegación: se parsean solo sus archivos (a través de cache, compartido
+    con la UI), se arma el reporte con la columna SI/NO sugerida y se suelta
+    todo antes de pasar a la siguiente. El PDF sale de render_pdfs, en
+    paralelo si pdf_workers > 1.
+
+    - names / read_bytes: nombres de los CSV y cómo leer el de la posición i
+    - dedupe: {tipo: True} para eliminar duplicadas (columnas clave por defecto)
+    - out_dir: si se da, cada PDF se escribe ahí directamente ("pdf" queda en None)
+
+    Produce un dict por delegación con las columnas de BATCH_SUMMARY_COLUMNS
+    más "pdf" (None si falló o si se escribió en out_dir).
+    """
+    jobs = _iter_batch_jobs(
+        names, read_bytes, cat_index, cache=cache, hora_reporte=hora_reporte,
+        fecha_str=fecha_str, logo_path=logo_path, dedupe=dedupe,
+        dedupe_minutes=dedupe_minutes, dedupe_mode=dedupe_mode,
+        include_catalog=include_catalog, out_dir=out_dir
+    )
+    for row in render_pdfs(jobs, max_workers=pdf_workers):
+        row["total_s"] = row["lectura_s"] + row["calculo_s"] + row["pdf_s"]
+        yield row
+
+
+def _iter_batch_jobs(
+    names, read_bytes, cat_index, cache, hora_reporte, fecha_str, logo_path,
+    dedupe, dedupe_minutes, dedupe_mode, include_catalog, out_dir
+) -> Iterator[dict]:
+    upload_index = build_upload_index(names)
+    fecha_str = fecha_str or fecha_es(datetime.now())
+    dedupe = dedupe or {}
+
+    delegations = batch_delegations(upload_index, cat_index, include_catalog=include_catalog)
+    for start in range(0, len(delegations), BATCH_INGEST_DELEGATIONS):
+        group = delegations[start:start + BATCH_INGEST_DELEGATIONS]
+        ingested = _ingest_batch_group(group, upload_index, names, read_bytes, cache)
+        for key, delegacion in group:
+            yield _batch_job(
+                key, delegacion, ingested, cat_index, hora_reporte, fecha_str, logo_path,
+                dedupe, dedupe_minutes, dedupe_mode, out_dir
+            )
+
+
+def _ingest_batch_group(group, upload_index, names, read_bytes, cache) -> dict:
+    """
+    {(clave, tipo): resultado de ingest_files} para un grupo de delegaciones,
+    con todos sus archivos parseados en una sola llamada (en el pool).
+    """
+    wanted = []
+    for key, _ in group:
+        for tipo in REPORT_TIPOS:
+            positions = upload_index["por_tipo"].get((key, tipo.lower()), [])
+            if positions:
+                # Igual que la UI: el primer archivo de cada tipo
+                wanted.append(((key, tipo), positions[0]))
+
+    out = {}
+    files = []
+    for k, pos in wanted:
+        t0 = time.perf_counter()
+        try:
+            files.append((k, (names[pos], read_bytes(pos))))
+        except Exception as e:
+            out[k] = _ingest_result(names[pos], None, time.perf_counter() - t0, e)
+    results = ingest_files([f for _, f in files], cache=cache)
+    out.update(zip([k for k, _ in files], results))
+    return out
+
+
+def _batch_job(
+    key, delegacion, ingested, cat_index, hora_reporte, fecha_str, logo_path,
+    dedupe, dedupe_minutes, dedupe_mode, out_dir
+) -> dict:
+    row = dict.fromkeys(BATCH_SUMMARY_COLUMNS, 0)
+    row.update({"Delegación": delegacion, "archivo_pdf": pdf_file_name(delegacion), "error": "", "pdf": None})
+    if out_dir is not None:
+        row["pdf_path"] = str(Path(out_dir) / row["archivo_pdf"])
+    try:
+        tables = {}
+        for tipo in REPORT_TIPOS:
+            res = ingested.get((key, tipo))
+            if res is None:
+                continue
+            row["lectura_s"] += res["seconds"]
+            if res["error"]:
+                raise ValueError(f"{res['name']}: {res['error']}")
+            tables[tipo] = res["table"]
+            row["archivos"] += 1
+        t1 = time.perf_counter()
+
+        cols = {}
+        for tipo, table in tables.items():
+            if table["nrows"] and dedupe.get(tipo):
+                table, dres = dedupe_table(table, minutes=dedupe_minutes, mode=dedupe_mode)
+                tables[tipo] = table
+                row["duplicadas"] += dres["removed"]
+            row["filas"] += table["nrows"]
+            if table["header"]:
+                cols[tipo] = choose_default_yesno_col(table["header"], table["data"], profile=table["profile"])
+
+        df_com = report_comunidad(cat_index, delegacion, tables.get("Comunidad"), cols.get("Comunidad"))
+        df_con = report_from_totals(cat_index, delegacion, "Comercio", tables.get("Comercio"), cols.get("Comercio"))
+        df_pol = report_from_totals(cat_index, delegacion, "Policial", tables.get("Policial"), cols.get("Policial"))
+        t2 = time.perf_counter()
+
+        row["pdf_args"] = {
+            "delegacion_label": f"Delegación: {delegacion}",
+            "hora_reporte": hora_reporte,
+            "fecha_str": fecha_str,
+            "logo_path": logo_path,
+            "df_com": df_com,
+            "df_con": df_con,
+            "df_pol": df_pol,
+        }
+        row["calculo_s"] = t2 - t1
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+
+def batch_summary(rows: list[dict]) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=BATCH_SUMMARY_COLUMNS)
+    for c in ("lectura_s", "calculo_s", "pdf_s", "total_s"):
+        df[c] = df[c].astype(float).round(3)
+    return df
+
+
+def write_reports_zip(reports: Iterable[dict], fh) -> pd.DataFrame:
+    """
+    Escribe cada PDF en el ZIP apenas se genera (no se juntan en memoria) y
+    al final agrega resumen.csv. Devuelve el resumen por delegación.
+    """
+    summary = []
+    with zipfile.ZipFile(fh, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for row in reports:
+            pdf = row.pop("pdf", None)
+            if pdf is not None:
+                zf.writestr(row["archivo_pdf"], pdf)
+            else:
+                row["archivo_pdf"] = ""
+            summary.append(row)
+
+        df = batch_summary(summary)
+        zf.writestr("resumen.csv", df.to_csv(index=False).encode("utf-8-sig"))
+    return df
+
+
+def write_reports_dir(reports: Iterable[dict], out_dir) -> pd.DataFrame:
+    """
+    Igual que write_reports_zip, pero deja los PDF y resumen.csv en una
+    carpeta. Los que ya vienen escritos (iter_batch_reports con out_dir) se
+    dejan como están.
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    summary = []
+    for row in reports:
+        pdf = row.pop("pdf", None)
+        if pdf is not None:
+            (out_dir / row["archivo_pdf"]).write_bytes(pdf)
+        elif row["error"]:
+            row["archivo_pdf"] = ""
+        summary.append(row)
+
+    df = batch_summary(summary)
+    df.to_csv(out_dir / "resumen.csv", index=False, encoding="utf-8-sig")
+    return df
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los módulos viven en la raíz del repo (no es un paquete instalable)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Exportes acumulados: la tabla que sale de extender la del archivo anterior
+(ParseCache._extend_previous y los deltas del ResultStore) contra parsear
+el archivo completo de cero.
+"""
+
+import csv
+import io
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import reporte_core as rc
+
+
+HEADER = ["Marca temporal", "Distrito", "¿Acepta participar?", "Comentario"]
+
+
+def survey_rows(n, seed):
+    rnd = random.Random(seed)
+    distritos = ["Carmen", "Zapote", "Cañas", ""]
+    t = datetime(2024, 5, 1, 8, 0)
+    rows, prev = [], None
+    for _ in range(n):
+        if prev is not None and rnd.random() < 0.25:
+            row = list(prev)
+        else:
+            row = ["", rnd.choice(distritos), rnd.choice(["Sí", "No", "", "si."]), rnd.choice(["", "bien", "dos\nlíneas"])]
+        t += timedelta(minutes=rnd.choice([0, 1, 3, 6]))
+        row[0] = t.strftime("%Y-%m-%d %H:%M:%S")
+        rows.append(row)
+        prev = row
+    return rows
+
+
+def to_csv(rows):
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows([HEADER] + rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def assert_same_table(got, expected):
+    assert got["header"] == expected["header"]
+    assert got["nrows"] == expected["nrows"]
+    assert got["data"].rows() == expected["data"].rows()
+    assert got["norm_cols"].rows() == expected["norm_cols"].rows()
+    assert np.array_equal(got["yesno"], expected["yesno"])
+    pd.testing.assert_frame_equal(got["profile"], expected["profile"])
+
+    got_f, got_res = rc.dedupe_table(got, 5)
+    exp_f, exp_res = rc.dedupe_table(expected, 5)
+    assert np.array_equal(got_res["keep"], exp_res["keep"])
+    pd.testing.assert_frame_equal(got_f["profile"], exp_f["profile"])
+
+
+@pytest.mark.parametrize("prefix_rows", [50, 400])
+def test_extend_matches_full_parse(prefix_rows):
+    rows = survey_rows(900, 7)
+    cache = rc.ParseCache()
+    prev = cache.get(to_csv(rows[:prefix_rows]))
+    # Las firmas de duplicadas del anterior también se extienden
+    rc.dedupe_table(prev, 5)
+
+    full = to_csv(rows)
+    table = cache.get(full)
+    assert table["append_of"] == (prev["key"], prefix_rows)
+    assert table["dedupe_inputs"]
+    assert_same_table(table, rc.build_table(full))
+
+
+def test_store_delta_reload_matches_full_parse(tmp_path):
+    rows = survey_rows(1200, 3)
+    cuts = [300, 500, 800, 1200]
+    store = rc.ResultStore(tmp_path / "resultados.sqlite")
+    cache = rc.ParseCache(store=store)
+    for n in cuts:
+        table = cache.get(to_csv(rows[:n]))
+    assert table["append_depth"] == len(cuts) - 1
+
+    # Otro proceso: sin nada en memoria, la tabla se arma con la cadena de deltas
+    full = to_csv(rows)
+    reloaded = rc.ParseCache(store=store).get(full)
+    assert reloaded["key"] == table["key"]
+    assert_same_table(reloaded, rc.build_table(full))
+
+    # Y se puede seguir extendiendo desde lo que está en el store
+    more = rows + survey_rows(150, 9)
+    extended = rc.ParseCache(store=store).get(to_csv(more))
+    assert extended["append_of"] == (table["key"], len(rows))
+    assert_same_table(extended, rc.build_table(to_csv(more)))
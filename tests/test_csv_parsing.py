@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Lectura de CSV: detección de encoding y dialecto, y read_csv_fast /
+parse_csv_robusto / iter_csv_chunks contra el parser original con el módulo
+csv (parse_csv_robusto del app.py original).
+"""
+
+import csv
+import io
+
+import pytest
+
+import reporte_core as rc
+
+
+def reference_parse(file_bytes, encoding="utf-8-sig", delimiter=","):
+    """
+    parse_csv_robusto del app.py original, con encoding y separador como
+    parámetros (el original solo leía UTF-8 con ",").
+    """
+    text = file_bytes.decode(encoding, errors="replace")
+    reader = csv.reader(io.StringIO(text), delimiter=delimiter, quotechar='"', skipinitialspace=False)
+    rows = [row for row in reader if row and not all(rc.norm(c) == "" for c in row)]
+    if not rows:
+        return [], []
+    header, ncols = rows[0], len(rows[0])
+    fixed = []
+    for r in rows[1:]:
+        if len(r) > ncols:
+            r = r[:ncols]
+        elif len(r) < ncols:
+            r = r + ([""] * (ncols - len(r)))
+        fixed.append(r)
+    return header, fixed
+
+
+def stray_byte_csv(n=200):
+    # Exporte UTF-8 con un byte suelto (un carácter cortado) en una celda
+    lines = ["Marca temporal,Distrito,¿Acepta?"]
+    lines += [f"2024-05-01 08:{i % 60:02d}:00,Carmen,Sí" for i in range(n)]
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+    return data.replace("Carmen".encode(), b"Carm\xc3n", 1)
+
+
+def test_stray_byte_keeps_utf8():
+    file_bytes = stray_byte_csv()
+    assert rc.sniff_encoding(file_bytes) == "utf-8-sig"
+    table = rc.build_table(file_bytes)
+    assert table["header"][2] == "¿Acepta?"
+    assert rc.table_yesno_counts(table, 2) == (200, 0)
+    assert table["data"].row(0)[1] == "Carm\ufffdn"
+
+
+def test_cp1252_still_detected():
+    file_bytes = "Distrito;¿Acepta?\nCañas;Sí\nCañas;No\n".encode("cp1252")
+    assert rc.sniff_encoding(file_bytes) == "cp1252"
+    table = rc.build_table(file_bytes)
+    assert table["header"] == ["Distrito", "¿Acepta?"]
+    assert rc.table_yesno_counts(table, 1) == (1, 1)
+
+
+def test_late_accent_cp1252_streamed(monkeypatch):
+    # Primer byte no ASCII después de la muestra: el streaming no puede
+    # decidir el encoding solo con el comienzo del archivo
+    lines = ["Distrito,Acepta"] + ["Carmen,No"] * 3000 + ["Cañas,Sí"]
+    file_bytes = ("\n".join(lines) + "\n").encode("cp1252")
+    assert file_bytes.find("ñ".encode("cp1252")) > rc.CSV_SNIFF_BYTES
+    in_memory = rc.build_table(file_bytes)
+    assert rc.table_yesno_counts(in_memory, 1) == (1, 3000)
+
+    monkeypatch.setattr(rc, "STREAM_THRESHOLD_BYTES", 1)
+    monkeypatch.setattr(rc, "CSV_SCAN_BLOCK_BYTES", 1000)
+    streamed = rc.build_table(file_bytes)
+    assert streamed["streamed"]
+    assert rc.table_yesno_counts(streamed, 1) == (1, 3000)
+    header, chunks = zip(*rc.iter_csv_chunks(file_bytes))
+    assert chunks[-1].row(len(chunks[-1]) - 1) == ["Cañas", "Sí"]
+
+
+HEADER = ["Marca temporal", "Distrito", "¿Acepta?", "Comentario"]
+ROWS = [
+    ["2024-05-01 08:00:00", "Cañas", "Sí", "bien"],
+    ["2024-05-01 08:01:00", "Carmen", "No"],
+    ["2024-05-01 08:02:00", "Zapote"],
+    ["2024-05-01 08:03:00", "Cañas", "sí", "dos\nlíneas", "extra", "otra"],
+    ["", "", "", "", "solo después del header"],
+    ["", " ", "", ""],
+    ["2024-05-01 08:04:00", "Carmen", "Sí", "con, coma"],
+    [],
+    ["2024-05-01 08:05:00", "Zapote", "NO", ""],
+]
+
+
+def to_csv(rows, delimiter=",", line_end="\n"):
+    buf = io.StringIO()
+    csv.writer(buf, delimiter=delimiter, lineterminator=line_end).writerows(rows)
+    return buf.getvalue()
+
+
+CASES = {
+    "utf8": (to_csv([HEADER] + ROWS).encode("utf-8"), "utf-8-sig", ","),
+    "utf8_crlf": (to_csv([HEADER] + ROWS, line_end="\r\n").encode("utf-8"), "utf-8-sig", ","),
+    "bom": (to_csv([HEADER] + ROWS).encode("utf-8-sig"), "utf-8-sig", ","),
+    "cp1252_semicolon": (to_csv([HEADER] + ROWS, delimiter=";").encode("cp1252"), "cp1252", ";"),
+    "utf16": (to_csv([HEADER] + ROWS).encode("utf-16"), "utf-16", ","),
+    "utf16_tab": (to_csv([HEADER] + ROWS, delimiter="\t").encode("utf-16"), "utf-16", "\t"),
+    "stray_byte": (stray_byte_csv(), "utf-8-sig", ","),
+    "header_only": (to_csv([HEADER]).encode("utf-8"), "utf-8-sig", ","),
+    "blank": (b"\n,,\n", "utf-8-sig", ","),
+}
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_sniff_dialect(case):
+    file_bytes, encoding, delimiter = CASES[case]
+    dialect = rc.sniff_csv(file_bytes)
+    if case != "blank":
+        assert (dialect["encoding"], dialect["delimiter"]) == (encoding, delimiter)
+
+
+@pytest.mark.parametrize("case", sorted(CASES))
+def test_readers_match_csv_module(case):
+    file_bytes, encoding, delimiter = CASES[case]
+    header, rows = reference_parse(file_bytes, encoding, delimiter)
+    dialect = rc.sniff_csv(file_bytes)
+
+    got_header, got = rc.parse_csv_robusto(file_bytes)
+    assert (got_header, got.rows()) == (header, rows)
+
+    if dialect["ncols"]:
+        got_header, got = rc.read_csv_fast(file_bytes, dialect)
+        assert (got_header, got.rows()) == (header, rows)
+
+    # Sin ncols (header que no entra en la muestra) va por el módulo csv
+    got_header, got = rc.parse_csv_robusto(file_bytes, dict(dialect, ncols=None))
+    assert (got_header, got.rows()) == (header, rows)
+
+    chunks = list(rc.iter_csv_chunks(file_bytes, chunk_rows=2))
+    assert [h for h, _ in chunks] == [header] * len(chunks)
+    assert [r for _, part in chunks for r in part.rows()] == rows
+
+
+def test_row_wider_than_extra_cols():
+    # Más columnas de las que lee el parser en C: igual sale como el original
+    rows = [HEADER] + ROWS + [["2024-05-01 08:06:00"] + ["x"] * (len(HEADER) + rc.CSV_EXTRA_COLS)]
+    file_bytes = to_csv(rows).encode("utf-8")
+    header, expected = reference_parse(file_bytes)
+    got_header, got = rc.parse_csv_robusto(file_bytes)
+    assert (got_header, got.rows()) == (header, expected)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+El motor de duplicadas (dedupe_keep y sus variantes) contra la versión
+original fila por fila de dedupe_within_minutes.
+"""
+
+import csv
+import io
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import reporte_core as rc
+
+
+def reference_keep(header, rows, minutes, mode=rc.DEDUPE_ANCHORED):
+    """
+    dedupe_within_minutes del app.py original (anchored), con la variante
+    sliding: la última fecha de la firma se actualiza aunque la fila se
+    elimine. Devuelve la máscara de filas conservadas.
+    """
+    dt_col = rc.detect_datetime_col(header, rows)
+    if dt_col is None:
+        return np.ones(len(rows), dtype=bool)
+
+    parsed = []
+    for idx, r in enumerate(rows):
+        dt = pd.to_datetime(r[dt_col] if dt_col < len(r) else "", errors="coerce")
+        parsed.append((idx, dt.to_pydatetime() if pd.notna(dt) else None, r))
+
+    valid = sorted((x for x in parsed if x[1] is not None), key=lambda x: x[1])
+    keep = np.array([x[1] is None for x in parsed], dtype=bool)
+    window = timedelta(minutes=minutes)
+    last_time_by_sig = {}
+    for idx, dt, r in valid:
+        sig = tuple(rc.norm(r[j]) for j in range(len(r)) if j != dt_col)
+        if sig in last_time_by_sig and (dt - last_time_by_sig[sig]) <= window:
+            if mode == rc.DEDUPE_SLIDING:
+                last_time_by_sig[sig] = dt
+            continue
+        last_time_by_sig[sig] = dt
+        keep[idx] = True
+    return keep
+
+
+def survey_rows(n, seed, extra_cols=3):
+    rnd = random.Random(seed)
+    answers = ["Sí", "si", " SI ", "No", "no.", "", "Tal vez"]
+    header = ["Marca temporal"] + [f"P{i}" for i in range(extra_cols)]
+    t = datetime(2024, 5, 1, 8, 0)
+    rows, prev = [], None
+    for _ in range(n):
+        if prev is not None and rnd.random() < 0.3:
+            row = list(prev)
+        else:
+            row = [""] + [rnd.choice(answers) for _ in range(extra_cols)]
+        t += timedelta(minutes=rnd.choice([0, 1, 2, 3, 5, 6, 12]), seconds=rnd.choice([0, 30]))
+        row[0] = t.isoformat(sep=" ")
+        if rnd.random() < 0.03:
+            row[0] = "fecha mala"
+        rows.append(row)
+        prev = row
+    # Algunas respuestas fuera de orden, como cuando se juntan exportes
+    for _ in range(n // 20):
+        i, j = rnd.randrange(n), rnd.randrange(n)
+        rows[i], rows[j] = rows[j], rows[i]
+    return header, rows
+
+
+def to_csv(header, rows) -> bytes:
+    out = io.StringIO()
+    w = csv.writer(out, lineterminator="\n")
+    w.writerow(header)
+    w.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+@pytest.mark.parametrize("mode", [rc.DEDUPE_ANCHORED, rc.DEDUPE_SLIDING])
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("minutes", [1, 5, 15])
+def test_engine_matches_row_by_row(mode, seed, minutes):
+    header, rows = survey_rows(400, seed)
+    expected = reference_keep(header, rows, minutes, mode)
+
+    res = rc.dedupe_engine(header, rows, minutes=minutes, mode=mode)
+    assert (res["keep"] == expected).all()
+    assert res["removed"] == int((~expected).sum())
+
+    # Mismo resultado desde la tabla por columnas y sus columnas normalizadas
+    table = rc.build_table(to_csv(header, rows))
+    res_t = rc.dedupe_engine(header, table["data"], minutes=minutes, mode=mode,
+                             norm_cols=table["norm_cols"], profile=table["profile"])
+    assert (res_t["keep"] == expected).all()
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_dedupe_within_minutes_matches_original(seed):
+    header, rows = survey_rows(300, seed)
+    expected = reference_keep(header, rows, 5)
+    kept, removed = rc.dedupe_within_minutes(header, rows, 5)
+    assert kept == [r for r, k in zip(rows, expected) if k]
+    assert removed == int((~expected).sum())
+
+
+@pytest.mark.parametrize("mode", [rc.DEDUPE_ANCHORED, rc.DEDUPE_SLIDING])
+@pytest.mark.parametrize("chunk_rows", [7, 64, 1000])
+def test_stream_matches_in_memory(mode, chunk_rows):
+    header, rows = survey_rows(500, 11)
+    file_bytes = to_csv(header, rows)
+    table = rc.build_table(file_bytes)
+    mem = rc.dedupe_engine(header, table["data"], minutes=5, mode=mode,
+                           norm_cols=table["norm_cols"], profile=table["profile"])
+
+    s_header, profile, nrows = rc.scan_stream(file_bytes, chunk_rows=chunk_rows)
+    stream = rc.dedupe_stream(file_bytes, s_header, profile, nrows, minutes=5, mode=mode, chunk_rows=chunk_rows)
+
+    assert (stream["keep"] == mem["keep"]).all()
+    assert stream["removed"] == mem["removed"]
+    assert stream["dt_col"] == mem["dt_col"]
+    pd.testing.assert_frame_equal(stream["groups"], mem["groups"])
+
+
+def test_only_timestamp_column():
+    # Sin columnas clave la firma es la misma para todas: solo cuenta la fecha
+    header, rows = survey_rows(120, 3, extra_cols=0)
+    file_bytes = to_csv(header, rows)
+    expected = reference_keep(header, rows, 5)
+    assert (~expected).sum() > 0
+
+    table = rc.build_table(file_bytes)
+    filtered, res = rc.dedupe_table(table, 5)
+    assert (res["keep"] == expected).all()
+    assert filtered["nrows"] == int(expected.sum())
+
+    kept, removed = rc.dedupe_within_minutes(header, rows, 5)
+    assert removed == int((~expected).sum())
+
+    s_header, profile, nrows = rc.scan_stream(file_bytes)
+    stream = rc.dedupe_stream(file_bytes, s_header, profile, nrows, minutes=5)
+    assert (stream["keep"] == expected).all()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tablas por bloques (archivos de más de STREAM_THRESHOLD_BYTES) contra la
+tabla en memoria: perfil, duplicadas, base por distrito y reportes.
+"""
+
+import csv
+import io
+import random
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import reporte_core as rc
+
+
+HEADER = ["Marca temporal", "Distrito", "¿Acepta participar?", "Comentario"]
+
+
+def survey_csv(n, seed, encoding="utf-8"):
+    rnd = random.Random(seed)
+    distritos = ["Carmen", "Zapote", "Cañas", "San Francisco", ""]
+    t = datetime(2024, 5, 1, 8, 0)
+    rows, prev = [], None
+    for _ in range(n):
+        if prev is not None and rnd.random() < 0.25:
+            row = list(prev)
+        else:
+            row = ["", rnd.choice(distritos), rnd.choice(["Sí", "si", "No", "", "NO."]), rnd.choice(["", "bien", "x"])]
+        t += timedelta(minutes=rnd.choice([0, 1, 3, 6]))
+        row[0] = t.strftime("%Y-%m-%d %H:%M:%S")
+        rows.append(row)
+        prev = row
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows([HEADER] + rows)
+    return buf.getvalue().encode(encoding)
+
+
+@pytest.fixture(scope="module")
+def cat_index(tmp_path_factory):
+    rows = [
+        (tipo, distrito, meta)
+        for tipo in rc.REPORT_TIPOS
+        for distrito, meta in (("Carmen", 40), ("Zapote", 25), ("Cañas", 10))
+    ]
+    df = pd.DataFrame(rows, columns=["Tipo", "Distrito", "Meta"])
+    df.insert(0, "Delegacion", "Carmen")
+    path = tmp_path_factory.mktemp("catalogo") / "catalogo_metas.xlsx"
+    df.to_excel(path, index=False)
+    return rc.load_catalog_index(str(path), cache_dir=None)
+
+
+def run_pipeline(file_bytes, cat_index):
+    table = rc.build_table(file_bytes)
+    col = rc.choose_default_yesno_col(table["header"], None, profile=table["profile"])
+    filtered, res = rc.dedupe_table(table, 5)
+    reports = {
+        tipo: rc.report_comunidad(cat_index, "Carmen", filtered, col) if tipo == "Comunidad"
+        else rc.report_from_totals(cat_index, "Carmen", tipo, filtered, col)
+        for tipo in rc.REPORT_TIPOS
+    }
+    return {
+        "table": table,
+        "col": col,
+        "res": res,
+        "filtered": filtered,
+        "base": rc.table_base_comunidad(filtered, col),
+        "reports": reports,
+    }
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "cp1252"])
+def test_streamed_matches_in_memory(monkeypatch, cat_index, encoding):
+    file_bytes = survey_csv(3000, 5, encoding)
+    mem = run_pipeline(file_bytes, cat_index)
+    assert not mem["table"].get("streamed")
+
+    monkeypatch.setattr(rc, "STREAM_THRESHOLD_BYTES", 1)
+    monkeypatch.setattr(rc, "STREAM_CHUNK_ROWS", 700)
+    stream = run_pipeline(file_bytes, cat_index)
+    assert stream["table"]["streamed"]
+
+    assert stream["table"]["header"] == mem["table"]["header"]
+    assert stream["table"]["nrows"] == mem["table"]["nrows"]
+    pd.testing.assert_frame_equal(stream["table"]["profile"], mem["table"]["profile"])
+    assert stream["col"] == mem["col"]
+
+    assert mem["res"]["removed"] > 0
+    assert stream["res"]["removed"] == mem["res"]["removed"]
+    assert np.array_equal(stream["res"]["keep"], mem["res"]["keep"])
+    assert stream["filtered"]["nrows"] == mem["filtered"]["nrows"]
+    pd.testing.assert_frame_equal(stream["filtered"]["profile"], mem["filtered"]["profile"])
+    assert rc.table_yesno_counts(stream["filtered"], stream["col"]) == rc.table_yesno_counts(mem["filtered"], mem["col"])
+
+    pd.testing.assert_frame_equal(stream["base"], mem["base"])
+    for tipo in rc.REPORT_TIPOS:
+        pd.testing.assert_frame_equal(stream["reports"][tipo], mem["reports"][tipo])